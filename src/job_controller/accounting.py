@@ -0,0 +1,97 @@
+"""
+Resource accounting of job runs.
+
+CPU times are measured for the thread that runs the job when the platform
+supports it (Linux), otherwise for the whole process. The peak memory is the
+growth of the process maximum resident set size during the run, so it is only
+accurate when the job is the only one running. Where the ``resource`` module
+is not available (Windows), only the CPU time of the thread is measured, as
+user time.
+"""
+
+import sys
+import time
+from datetime import timedelta
+from django.db import connection
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+RUSAGE_THREAD = getattr(resource, "RUSAGE_THREAD", None)
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+MAXRSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+class ResourceUsage:
+    """
+    Context manager that measures the resources used by the current thread::
+
+        with ResourceUsage() as usage:
+            job.execute()
+        usage.cpu_user, usage.queries, ...
+    """
+
+    def __init__(self):
+        self.cpu_user = None
+        self.cpu_system = None
+        self.peak_memory = None
+        self.queries = None
+        self.query_time = None
+        self.output_bytes = None
+
+    def _cpu_usage(self):
+        """
+        Returns the user and system CPU seconds used so far.
+        """
+        if resource is None:
+            return time.thread_time(), 0
+        if RUSAGE_THREAD is not None:
+            usage = resource.getrusage(RUSAGE_THREAD)
+        else:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_utime, usage.ru_stime
+
+    def _maxrss(self):
+        if resource is None:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+
+    def _execute_wrapper(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_time += timedelta(
+                seconds=time.perf_counter() - started
+            )
+
+    def __enter__(self):
+        self.queries = 0
+        self.query_time = timedelta(0)
+        self._start_cpu = self._cpu_usage()
+        self._start_maxrss = self._maxrss()
+        self._wrapper = connection.execute_wrapper(self._execute_wrapper)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._wrapper.__exit__(exc_type, exc_value, traceback)
+        user, system = self._cpu_usage()
+        self.cpu_user = timedelta(seconds=user - self._start_cpu[0])
+        self.cpu_system = timedelta(seconds=system - self._start_cpu[1])
+        if self._start_maxrss is not None:
+            self.peak_memory = self._maxrss() - self._start_maxrss
+        return False
+
+    def as_dict(self):
+        return {
+            "cpu_user": self.cpu_user,
+            "cpu_system": self.cpu_system,
+            "peak_memory": self.peak_memory,
+            "queries": self.queries,
+            "query_time": self.query_time,
+            "output_bytes": self.output_bytes,
+        }
@@ -1,13 +1,18 @@
 from django.contrib import admin, messages
 from django.core.exceptions import PermissionDenied
+from django.db.models import Count, F, Max, Sum
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404, redirect
+from django.template.response import TemplateResponse
 from django.urls import reverse, path
 from django.utils import timezone
 from django.utils.formats import localize
 from django.utils.safestring import mark_safe
 from django.utils.translation import gettext as _
 from django_extensions.management.jobs import get_job, get_jobs
-from .models import Cronjob, JobSchedule
+from .cron import next_fire_times
+from .models import ControllerNode, ControllerPhase, Cronjob, JobSchedule
+from .profiling import decompress, top_functions
 
 
 class JobScheduleInline(admin.TabularInline):
@@ -18,6 +23,7 @@ class JobScheduleInline(admin.TabularInline):
         "started",
         "time_spent",
         "has_errors",
+        "attempt",
         "get_runner",
     ]
     readonly_fields = fields
@@ -55,6 +61,7 @@ class CronjobAdmin(admin.ModelAdmin):
         "get_description",
         "cron_expression",
         "get_schedule",
+        "spread_mode",
         "get_runner",
         "last_digest",
     )
@@ -68,15 +75,61 @@ class CronjobAdmin(admin.ModelAdmin):
         "digest_days",
         "error_only",
         "last_digest",
+        "spread_mode",
+        "spread_window",
+        "retry_attempts",
+        "retry_delay",
+        "retry_backoff",
+        "retry_max_delay",
+        "retry_jitter",
+        "profile_next_run",
+        "profile_every",
     ]
     readonly_fields = ("job_name", "app_name", "get_description", "last_digest")
     inlines = [JobScheduleInline]
+    change_list_template = "admin/job_controller/cronjob/change_list.html"
+    timeline_runs = 5
+    # Metrics to rank jobs by resource usage: name -> (label, aggregation)
+    usage_metrics = {
+        "time_spent": (_("time spent"), Sum("time_spent")),
+        "cpu": (_("CPU time"), Sum(F("cpu_user") + F("cpu_system"))),
+        "peak_memory": (_("peak memory growth"), Max("peak_memory")),
+        "queries": (_("SQL queries"), Sum("queries")),
+        "query_time": (_("time spent on SQL queries"), Sum("query_time")),
+        "output_bytes": (_("output size"), Sum("output_bytes")),
+    }
+
+    # Changes of these fields move the next schedule of the job
+    schedule_fields = ("cron_expression", "spread_mode", "spread_window")
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not (change and set(self.schedule_fields) & set(form.changed_data)):
+            return
+        try:
+            obj.reschedule()
+        except ValueError as e:
+            self.message_user(
+                request,
+                _("The job could not be rescheduled: {error}").format(error=e),
+                messages.WARNING,
+            )
 
     def get_urls(self):
         urls = super().get_urls()
         model_info = (self.model._meta.app_label, self.model._meta.model_name)
 
         my_urls = [
+            path(
+                "timeline/",
+                self.admin_site.admin_view(self.timeline),
+                name="%s_%s_timeline" % model_info,
+            ),
+            path(
+                "usage/",
+                self.admin_site.admin_view(self.resource_usage),
+                name="%s_%s_usage" % model_info,
+            ),
             path(
                 "<path:object_id>/runjob/",
                 self.admin_site.admin_view(self.run_job),
@@ -97,6 +150,14 @@ class CronjobAdmin(admin.ModelAdmin):
         if sched is None:
             return _("No schedules for this job")
         if sched.status == JobSchedule.STATUS_SCHEDULED:
+            if sched.offset:
+                return _(
+                    "scheduled start for {start} ({seconds} seconds after "
+                    "the CRON instant)"
+                ).format(
+                    start=localize(timezone.localtime(sched.start)),
+                    seconds=int(sched.offset.total_seconds()),
+                )
             return _("scheduled start for {start}").format(
                 start=localize(timezone.localtime(sched.start))
             )
@@ -117,6 +178,107 @@ class CronjobAdmin(admin.ModelAdmin):
         url = reverse("admin:job_controller_cronjob_runjob", args=[job.id])
         return f"<a href='{url}'>{_('run')}</a>"
 
+    def timeline(self, request):
+        """
+        Shows the next runs of all jobs and how many runs start in each hour
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        try:
+            hours = min(max(int(request.GET.get("hours", 24)), 1), 168)
+        except ValueError:
+            hours = 24
+        now = timezone.localtime()
+        first_hour = now.replace(minute=0, second=0, microsecond=0)
+        end = first_hour + timezone.timedelta(hours=hours)
+        jobs = list(Cronjob.objects.all())
+        fire_times = next_fire_times(
+            [job.cron_expression for job in jobs], now, end
+        )
+        counts = [0] * hours
+        timeline = []
+        for job in jobs:
+            job_times = fire_times[job.cron_expression]
+            for fire_time in job_times:
+                hour = (fire_time - first_hour).total_seconds() // 3600
+                counts[min(int(hour), hours - 1)] += 1
+            timeline.append(
+                {
+                    "job": job,
+                    "count": len(job_times),
+                    "next_runs": job_times[: self.timeline_runs],
+                }
+            )
+        peak = max(counts) or 1
+        histogram = [
+            {
+                "hour": first_hour + timezone.timedelta(hours=hour),
+                "count": count,
+                "percent": 100 * count // peak,
+            }
+            for hour, count in enumerate(counts)
+        ]
+        context = {
+            **self.admin_site.each_context(request),
+            "title": _("Runs timeline"),
+            "opts": self.model._meta,
+            "hours": hours,
+            "timeline": timeline,
+            "histogram": histogram,
+        }
+        return TemplateResponse(
+            request, "admin/job_controller/cronjob/timeline.html", context
+        )
+
+    def resource_usage(self, request):
+        """
+        Shows the jobs that used more resources in the last days
+        """
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        try:
+            days = min(max(int(request.GET.get("days", 7)), 1), 365)
+            top = min(max(int(request.GET.get("top", 10)), 1), 100)
+        except ValueError:
+            days, top = 7, 10
+        order = request.GET.get("order", "cpu")
+        if order not in self.usage_metrics:
+            order = "cpu"
+        since = timezone.now() - timezone.timedelta(days=days)
+        rows = (
+            JobSchedule.objects.filter(
+                status=JobSchedule.STATUS_FINISHED, started__gte=since
+            )
+            .values("job", "job__app_name", "job__job_name")
+            .annotate(
+                runs=Count("id"),
+                **{
+                    metric: aggregation
+                    for metric, (_label, aggregation) in (
+                        self.usage_metrics.items()
+                    )
+                },
+            )
+            .exclude(**{f"{order}__isnull": True})
+            .order_by(F(order).desc(nulls_last=True))[:top]
+        )
+        context = {
+            **self.admin_site.each_context(request),
+            "title": _("Resource usage"),
+            "opts": self.model._meta,
+            "days": days,
+            "top": top,
+            "order": order,
+            "metrics": [
+                (metric, label)
+                for metric, (label, _aggregation) in self.usage_metrics.items()
+            ],
+            "rows": rows,
+        }
+        return TemplateResponse(
+            request, "admin/job_controller/cronjob/usage.html", context
+        )
+
     def run_job(self, request, object_id):
         cronjob = get_object_or_404(Cronjob, id=object_id)
         sched = cronjob.next_schedule()
@@ -144,6 +306,7 @@ class JobScheduleAdmin(admin.ModelAdmin):
         "job",
         "status",
         "has_errors",
+        "attempt",
         "start",
         "started",
         "time_spent",
@@ -153,9 +316,19 @@ class JobScheduleAdmin(admin.ModelAdmin):
         "job",
         "status",
         "has_errors",
+        "attempt",
+        "retry_of",
         "start",
+        "offset",
         "started",
         "time_spent",
+        "cpu_user",
+        "cpu_system",
+        "peak_memory",
+        "queries",
+        "query_time",
+        "output_bytes",
+        "get_profile",
         "result",
     ]
     readonly_fields = fields
@@ -172,6 +345,16 @@ class JobScheduleAdmin(admin.ModelAdmin):
                 self.admin_site.admin_view(self.run_job),
                 name="%s_%s_runjob" % model_info,
             ),
+            path(
+                "<path:object_id>/profile/",
+                self.admin_site.admin_view(self.download_profile),
+                name="%s_%s_profile" % model_info,
+            ),
+            path(
+                "<path:object_id>/profile/top/",
+                self.admin_site.admin_view(self.profile_top),
+                name="%s_%s_profile_top" % model_info,
+            ),
         ]
         return my_urls + urls
 
@@ -197,6 +380,57 @@ class JobScheduleAdmin(admin.ModelAdmin):
             return f"<a href='{url}'>{_('run')}</a>"
         return ""
 
+    @mark_safe
+    @admin.display(description=_("profile"))
+    def get_profile(self, sched):
+        if not hasattr(sched, "profile"):
+            return _("This run was not profiled")
+        download_url = reverse(
+            "admin:job_controller_jobschedule_profile", args=[sched.id]
+        )
+        top_url = reverse(
+            "admin:job_controller_jobschedule_profile_top", args=[sched.id]
+        )
+        return (
+            f"<a href='{download_url}'>{_('Download')}</a> | "
+            f"<a href='{top_url}'>{_('Top functions')}</a>"
+        )
+
+    def _get_profile(self, request, object_id):
+        sched = get_object_or_404(JobSchedule, id=object_id)
+        if not self.has_view_permission(request, sched):
+            raise PermissionDenied
+        if not hasattr(sched, "profile"):
+            raise Http404(_("This run was not profiled"))
+        return sched, sched.profile
+
+    def download_profile(self, request, object_id):
+        sched, profile = self._get_profile(request, object_id)
+        response = HttpResponse(
+            decompress(profile.data), content_type="application/octet-stream"
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="{sched.job.job_name}-{sched.id}.prof"'
+        )
+        return response
+
+    def profile_top(self, request, object_id):
+        sched, profile = self._get_profile(request, object_id)
+        sort = request.GET.get("sort", "cumulative")
+        if sort not in ("cumulative", "tottime", "ncalls"):
+            sort = "cumulative"
+        context = {
+            **self.admin_site.each_context(request),
+            "title": _("Top functions of {schedule}").format(schedule=sched),
+            "opts": self.model._meta,
+            "original": sched,
+            "sort": sort,
+            "report": top_functions(profile.data, sort=sort),
+        }
+        return TemplateResponse(
+            request, "admin/job_controller/jobschedule/profile.html", context
+        )
+
     def run_job(self, request, object_id):
         sched = get_object_or_404(JobSchedule, id=object_id)
         if sched.status != JobSchedule.STATUS_SCHEDULED:
@@ -222,3 +456,38 @@ class JobScheduleAdmin(admin.ModelAdmin):
         return redirect(
             "admin:job_controller_jobschedule_change", object_id=object_id
         )
+
+
+@admin.register(ControllerPhase)
+class ControllerPhaseAdmin(admin.ModelAdmin):
+    list_display = [
+        "name",
+        "node",
+        "last_run",
+        "time_spent",
+        "cursor",
+        "leader",
+        "lease_expires",
+        "fencing_token",
+    ]
+    fields = list_display
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ControllerNode)
+class ControllerNodeAdmin(admin.ModelAdmin):
+    list_display = ["name", "joined", "heartbeat"]
+    fields = list_display
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class JobControllerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'job_controller'
+
+    def ready(self):
+        from . import signals  # noqa: F401
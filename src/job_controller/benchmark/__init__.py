@@ -0,0 +1,8 @@
+"""
+Benchmark and load-test harness for the job controller.
+
+Add ``job_controller.benchmark`` to ``INSTALLED_APPS`` of a benchmark settings
+module (never in production, as it provides synthetic jobs) and run::
+
+    python manage.py benchmark_controller --output report.json
+"""
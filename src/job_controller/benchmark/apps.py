@@ -0,0 +1,6 @@
+from django.apps import AppConfig
+
+
+class BenchmarkConfig(AppConfig):
+    name = 'job_controller.benchmark'
+    label = 'job_controller_benchmark'
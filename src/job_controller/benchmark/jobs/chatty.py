@@ -0,0 +1,12 @@
+import sys
+from django_extensions.management.jobs import BaseJob
+
+
+class Job(BaseJob):
+    help = "Benchmark job that writes a lot of output"
+
+    def execute(self):
+        for i in range(2000):
+            print(f"message {i}: " + "x" * 60)
+        for i in range(20):
+            print(f"warning {i}", file=sys.stderr)
@@ -0,0 +1,8 @@
+from django_extensions.management.jobs import BaseJob
+
+
+class Job(BaseJob):
+    help = "Benchmark job that burns CPU for a while"
+
+    def execute(self):
+        sum(i * i for i in range(500000))
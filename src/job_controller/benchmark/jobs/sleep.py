@@ -0,0 +1,9 @@
+import time
+from django_extensions.management.jobs import BaseJob
+
+
+class Job(BaseJob):
+    help = "Benchmark job that sleeps for 100 milliseconds"
+
+    def execute(self):
+        time.sleep(0.1)
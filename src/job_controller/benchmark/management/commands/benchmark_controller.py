@@ -0,0 +1,115 @@
+import io
+import json
+import os
+import tempfile
+from contextlib import redirect_stdout
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils.translation import gettext as _
+from job_controller.benchmark import runner
+
+# Seconds a thread waits for the SQLite database lock
+SQLITE_TIMEOUT = 60
+
+
+class Command(BaseCommand):
+    help = _(
+        "Benchmark the job controller phases in a temporary test database "
+        "and print a JSON report"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "scenarios",
+            nargs="*",
+            help=_("Scenarios to run: {scenarios}. Default: all.").format(
+                scenarios=", ".join(runner.SCENARIOS)
+            ),
+        )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            help=_("Override the number of cron jobs of each scenario"),
+        )
+        parser.add_argument(
+            "--history",
+            type=int,
+            help=_("Override the number of historical runs of each scenario"),
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=300,
+            help=_("Maximum seconds to wait for the dispatched runs"),
+        )
+        parser.add_argument(
+            "--output",
+            help=_("Write the report to this file instead of stdout"),
+        )
+
+    def handle(self, *args, **options):
+        # Validated here because argparse rejects an empty list of choices
+        scenarios = options["scenarios"] or list(runner.SCENARIOS)
+        unknown = set(scenarios) - set(runner.SCENARIOS)
+        if unknown:
+            raise CommandError(
+                _("Unknown scenarios: {scenarios}").format(
+                    scenarios=", ".join(sorted(unknown))
+                )
+            )
+        # Never touch the real data: run on a fresh test database. The SQLite
+        # in-memory test database cannot be shared by the threads that run
+        # the jobs, so use a temporary file instead.
+        if connection.vendor == "sqlite" and not connection.settings_dict[
+            "TEST"
+        ].get("NAME"):
+            connection.settings_dict["TEST"]["NAME"] = os.path.join(
+                tempfile.gettempdir(), "job_controller_benchmark.sqlite3"
+            )
+        if connection.vendor == "sqlite":
+            # The threads running the jobs write at the same time: wait for
+            # the database lock instead of failing with "database is locked".
+            # Transactions must take the lock when they begin, since SQLite
+            # fails at once, without waiting, when a transaction that has
+            # read tries to write while another one is writing.
+            db_options = connection.settings_dict["OPTIONS"]
+            db_options.setdefault("timeout", SQLITE_TIMEOUT)
+            if django.VERSION >= (5, 1):
+                db_options.setdefault("transaction_mode", "IMMEDIATE")
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            # The job controller threads print their progress, which must
+            # not be mixed with the report
+            with override_settings(
+                EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend"
+            ), redirect_stdout(io.StringIO()):
+                report = runner.run(
+                    scenarios,
+                    jobs=options["jobs"],
+                    history=options["history"],
+                    timeout=options["timeout"],
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        for scenario in report["scenarios"]:
+            if not scenario["valid"]:
+                self.stderr.write(
+                    _(
+                        "Scenario {scenario} is not valid: {count} of the "
+                        "{due} dispatched runs did not finish."
+                    ).format(
+                        scenario=scenario["scenario"],
+                        count=scenario["unfinished"],
+                        due=scenario["due"],
+                    )
+                )
+        data = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as output:
+                output.write(data)
+        else:
+            self.stdout.write(data)
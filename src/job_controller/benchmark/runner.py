@@ -0,0 +1,232 @@
+import platform
+import statistics
+import threading
+import time
+import tracemalloc
+import django
+from functools import partial
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django_extensions.management.jobs import get_jobs
+from job_controller.jobs.job_controller import RUN_THREAD_PREFIX, Job
+from job_controller.models import (
+    ControllerNode,
+    ControllerPhase,
+    Cronjob,
+    JobSchedule,
+)
+
+APP_NAME = "job_controller.benchmark"
+
+# name: (cron jobs, historical runs, due jobs, synthetic job kinds)
+SCENARIOS = {
+    "idle": (150, 10000, 0, ["sleep"]),
+    "history": (50, 100000, 0, ["sleep"]),
+    "burst-sleep": (150, 0, 150, ["sleep"]),
+    "burst-cpu": (20, 0, 20, ["cpu"]),
+    "chatty": (20, 0, 20, ["chatty"]),
+    "mixed": (150, 10000, 50, ["sleep", "cpu", "chatty"]),
+}
+
+
+def seed(jobs, history, due, kinds):
+    """
+    Create `jobs` cron jobs with `history` finished runs between them, of
+    which `due` have a schedule to start now.
+    """
+    now = timezone.now()
+    Cronjob.objects.bulk_create(
+        [
+            Cronjob(
+                app_name=APP_NAME,
+                job_name=kinds[i % len(kinds)],
+                cron_expression="0 0 * * *",
+                email_recipient="benchmark@example.com" if i % 2 else "",
+                digest_days=i % 3,
+                log_duration=30,
+            )
+            for i in range(jobs)
+        ]
+    )
+    cronjobs = list(Cronjob.objects.all())
+    JobSchedule.objects.bulk_create(
+        [
+            JobSchedule(
+                job=cronjobs[i % len(cronjobs)],
+                start=now - timezone.timedelta(minutes=37 * (i + 1)),
+                started=now - timezone.timedelta(minutes=37 * (i + 1)),
+                status=JobSchedule.STATUS_FINISHED,
+                time_spent=timezone.timedelta(seconds=i % 60),
+                result="MESSAGES\n--------\n" + "x" * (i % 500),
+                has_errors=i % 10 == 0,
+                reported=i % 4 != 0,
+            )
+            for i in range(history)
+        ],
+        batch_size=1000,
+    )
+    JobSchedule.objects.bulk_create(
+        [JobSchedule(job=cronjob, start=now) for cronjob in cronjobs[:due]]
+    )
+
+
+def clear():
+    JobSchedule.objects.all().delete()
+    Cronjob.objects.all().delete()
+    ControllerPhase.objects.all().delete()
+    ControllerNode.objects.all().delete()
+
+
+def measure(function):
+    """
+    Run `function` and returns its wall time, query count and peak memory.
+    """
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "seconds": elapsed,
+        "queries": len(queries),
+        "query_seconds": sum(float(q["time"]) for q in queries),
+        "peak_memory": peak,
+    }
+
+
+class BenchmarkJob(Job):
+    """
+    The job controller, measuring each phase it runs and recording the
+    errors that ended the threads running the jobs.
+    """
+
+    # The seeded cron jobs share the names of the synthetic jobs, which
+    # sync_new_jobs does not support. The job discovery, which is the bulk of
+    # both phases, is measured apart.
+    phases = [
+        (
+            phase.configure(enabled=False)
+            if phase.name in ("remove_old_jobs", "sync_new_jobs")
+            else phase
+        )
+        for phase in Job.phases
+    ]
+
+    def __init__(self):
+        super().__init__()
+        self.stats = {}
+        self.errors = []
+
+    def run_phase(self, phase):
+        self.stats[phase.name] = measure(partial(super().run_phase, phase))
+
+    def _job_starter(self, schedule):
+        try:
+            super()._job_starter(schedule)
+        except Exception as e:
+            self.errors.append(f"{schedule.job.job_name}: {e}")
+
+
+def wait_for_runs(timeout):
+    """
+    Wait until the threads running the dispatched jobs end, or `timeout`
+    seconds. Returns the time waited.
+    """
+    started = time.perf_counter()
+    for thread in threading.enumerate():
+        if thread.name.startswith(RUN_THREAD_PREFIX):
+            thread.join(max(timeout - (time.perf_counter() - started), 0))
+    return time.perf_counter() - started
+
+
+def dispatch_lag(schedule_ids):
+    """
+    Statistics, in seconds, of the delay between the scheduled and the
+    actual start of the runs in `schedule_ids`.
+    """
+    lags = sorted(
+        (started - start).total_seconds()
+        for start, started in JobSchedule.objects.filter(
+            pk__in=schedule_ids
+        ).values_list("start", "started")
+        if started is not None
+    )
+    if not lags:
+        return None
+    return {
+        "runs": len(lags),
+        "mean": statistics.mean(lags),
+        "p95": lags[max(int(len(lags) * 0.95) - 1, 0)],
+        "max": lags[-1],
+    }
+
+
+def run_scenario(name, jobs, history, due, kinds, timeout=300):
+    clear()
+    seed_stats = measure(lambda: seed(jobs, history, due, kinds))
+    controller = BenchmarkJob()
+    result = {
+        "scenario": name,
+        "jobs": jobs,
+        "history": history,
+        "due": due,
+        "kinds": kinds,
+        "seed": seed_stats,
+        "phases": {"discovery": measure(get_jobs)},
+    }
+    due_ids = list(
+        JobSchedule.objects.filter(
+            status=JobSchedule.STATUS_SCHEDULED
+        ).values_list("pk", flat=True)
+    )
+    # The lag is measured from the start of the job controller, not from
+    # the seeding
+    JobSchedule.objects.filter(pk__in=due_ids).update(start=timezone.now())
+    started = time.perf_counter()
+    controller.execute()
+    result["tick_seconds"] = time.perf_counter() - started
+    result["drain_seconds"] = wait_for_runs(timeout)
+    if controller.background_lane is not None:
+        controller.background_lane.join(timeout)
+    result["phases"].update(controller.stats)
+    result["dispatch_lag"] = dispatch_lag(due_ids)
+    result["unfinished"] = (
+        JobSchedule.objects.filter(pk__in=due_ids)
+        .exclude(status=JobSchedule.STATUS_FINISHED)
+        .count()
+    )
+    result["errors"] = controller.errors
+    # The timings are meaningless if runs failed or did not end
+    result["valid"] = result["unfinished"] == 0
+    clear()
+    return result
+
+
+def run(scenarios, jobs=None, history=None, timeout=300):
+    """
+    Run the named `scenarios`, optionally overriding their number of cron
+    jobs and historical runs. Returns the report as a dict.
+    """
+    report = {
+        "created": timezone.now().isoformat(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "scenarios": [],
+    }
+    for name in scenarios:
+        scenario_jobs, scenario_history, due, kinds = SCENARIOS[name]
+        if jobs is not None:
+            due = min(due, jobs)
+            scenario_jobs = jobs
+        if history is not None:
+            scenario_history = history
+        report["scenarios"].append(
+            run_scenario(
+                name, scenario_jobs, scenario_history, due, kinds, timeout
+            )
+        )
+    return report
@@ -0,0 +1,80 @@
+"""
+Capture of the output of job runs.
+
+Jobs run at the same time in several threads, so their output cannot be
+captured by replacing ``sys.stdout`` and ``sys.stderr`` for the whole
+process, like ``contextlib.redirect_stdout`` does. Instead, both streams are
+replaced once by proxies that send what each thread writes to the buffers of
+that thread while it captures its output, and to the original stream
+otherwise.
+"""
+
+import io
+import sys
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+_lock = threading.Lock()
+
+
+class ThreadStream:
+    """
+    Proxy of the standard stream `name` ("stdout" or "stderr")
+    """
+
+    def __init__(self, name, stream):
+        self._name = name
+        self._stream = stream
+
+    def _target(self):
+        buffers = getattr(_local, "buffers", None)
+        if buffers is not None:
+            return buffers[self._name]
+        return self._stream
+
+    def write(self, text):
+        target = self._target()
+        if target is None:
+            return len(text)
+        return target.write(text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        target = self._target()
+        if target is not None:
+            target.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+def _install(name):
+    with _lock:
+        stream = getattr(sys, name)
+        if not isinstance(stream, ThreadStream):
+            setattr(sys, name, ThreadStream(name, stream))
+
+
+@contextmanager
+def capture_output():
+    """
+    Capture what the current thread writes to ``sys.stdout`` and
+    ``sys.stderr``::
+
+        with capture_output() as (stdout, stderr):
+            job.execute()
+        messages = stdout.getvalue()
+    """
+    _install("stdout")
+    _install("stderr")
+    previous = getattr(_local, "buffers", None)
+    stdout, stderr = io.StringIO(), io.StringIO()
+    _local.buffers = {"stdout": stdout, "stderr": stderr}
+    try:
+        yield stdout, stderr
+    finally:
+        _local.buffers = previous
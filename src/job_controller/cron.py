@@ -0,0 +1,192 @@
+"""
+Fast computation of CRON fire times.
+
+CRON expressions are parsed by cron-converter only once and compiled to one
+bitset per field (minute, hour, day, month and day of week). Finding the next
+fire time then jumps straight to the next matching month, day, hour and
+minute instead of building a new scheduler for each call.
+
+Fire times are computed in local wall time and then bound to the timezone. On
+DST changes, a time skipped by the change happens at the same instant one hour
+later in the new offset (once, if that instant is also a fire time), and a
+repeated time happens only once, at its first occurrence. Successive fire
+times are always strictly increasing instants.
+"""
+
+import calendar
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache
+from itertools import islice
+from cron_converter import Cron
+from django.utils import timezone
+
+# A day that matches the expression exists within this many years. The
+# calendar repeats every 400 years, but 28 covers every weekday/leap day
+# combination.
+MAX_YEARS = 28
+
+
+def _bitset(values):
+    mask = 0
+    for value in values:
+        mask |= 1 << value
+    return mask
+
+
+def _next_bit(mask, start):
+    """
+    Returns the smallest bit set in `mask` greater or equal to `start`, or
+    None if there is none.
+    """
+    mask >>= start
+    if not mask:
+        return None
+    return start + (mask & -mask).bit_length() - 1
+
+
+class CompiledCron:
+    """
+    A CRON expression compiled to bitsets. Use `compile_cron` to get one.
+    """
+
+    def __init__(self, expression):
+        minutes, hours, days, months, weekdays = Cron(expression).to_list()
+        self.expression = expression
+        self.minutes = _bitset(minutes)
+        self.hours = _bitset(hours)
+        self.days = _bitset(days)
+        self.months = _bitset(months)
+        # cron counts weekdays from sunday, python from monday
+        self.weekdays = _bitset((weekday - 1) % 7 for weekday in weekdays)
+
+    def __repr__(self):
+        return f"CompiledCron({self.expression!r})"
+
+    def _match_day(self, year, month, day):
+        return (self.days >> day) & 1 and (
+            self.weekdays >> calendar.weekday(year, month, day)
+        ) & 1
+
+    def _next_wall_time(self, wall):
+        """
+        Returns the first naive wall time matching the expression at or
+        after the naive datetime `wall`, truncated to the minute.
+        """
+        year, month, day = wall.year, wall.month, wall.day
+        hour, minute = wall.hour, wall.minute
+        last_year = year + MAX_YEARS
+        while year <= last_year:
+            next_month = _next_bit(self.months, month)
+            if next_month is None:
+                year, month, day, hour, minute = year + 1, 1, 1, 0, 0
+                continue
+            if next_month != month:
+                month, day, hour, minute = next_month, 1, 0, 0
+            month_days = calendar.monthrange(year, month)[1]
+            while day <= month_days and not self._match_day(year, month, day):
+                day, hour, minute = day + 1, 0, 0
+            if day > month_days:
+                month, day, hour, minute = month + 1, 1, 0, 0
+                if month > 12:
+                    year, month = year + 1, 1
+                continue
+            next_hour = _next_bit(self.hours, hour)
+            if next_hour is None:
+                day, hour, minute = day + 1, 0, 0
+                if day > month_days:
+                    month, day = month + 1, 1
+                    if month > 12:
+                        year, month = year + 1, 1
+                continue
+            if next_hour != hour:
+                hour, minute = next_hour, 0
+            next_minute = _next_bit(self.minutes, minute)
+            if next_minute is None:
+                hour, minute = hour + 1, 0
+                if hour > 23:
+                    day, hour = day + 1, 0
+                    if day > month_days:
+                        month, day = month + 1, 1
+                        if month > 12:
+                            year, month = year + 1, 1
+                continue
+            return datetime(year, month, day, hour, next_minute)
+        raise ValueError(f"The CRON expression {self.expression} never fires")
+
+    def next(self, after=None, tz=None):
+        """
+        Returns the first fire time strictly after the aware datetime
+        `after` (default: now), in the timezone `tz` (default: the current
+        timezone).
+        """
+        if tz is None:
+            tz = timezone.get_current_timezone()
+        if after is None:
+            after = timezone.now()
+        # Going through UTC gives the actual wall time of `after`, even when
+        # it was built from a time skipped by a DST change or is the second
+        # occurrence of a repeated time. Instants are compared in UTC too,
+        # since datetimes sharing a tzinfo are compared by their wall time.
+        after = after.astimezone(dt_timezone.utc)
+        wall = after.astimezone(tz).replace(
+            tzinfo=None, second=0, microsecond=0
+        )
+        while True:
+            wall = self._next_wall_time(wall + timedelta(minutes=1))
+            fire_time = wall.replace(tzinfo=tz).astimezone(dt_timezone.utc)
+            # The first occurrence of a repeated time may be before `after`
+            if fire_time > after:
+                return fire_time.astimezone(tz)
+
+    def iter(self, start, end=None, tz=None):
+        """
+        Yields the fire times after `start` and up to `end` (inclusive).
+        """
+        if tz is None:
+            tz = timezone.get_current_timezone()
+        if end is not None:
+            end = end.astimezone(dt_timezone.utc)
+        fire_time = self.next(start, tz)
+        while end is None or fire_time.astimezone(dt_timezone.utc) <= end:
+            yield fire_time
+            fire_time = self.next(fire_time, tz)
+
+
+@lru_cache(maxsize=1024)
+def compile_cron(expression):
+    """
+    Returns the CompiledCron of `expression`, reusing the previous ones.
+
+    Raises:
+        ValueError: if the expression is invalid.
+    """
+    return CompiledCron(expression)
+
+
+def next_fire_times(expressions, start, end, limit=None, tz=None):
+    """
+    Computes the fire times of many CRON expressions at once.
+
+    Args:
+        expressions: iterable of CRON expressions. Repeated expressions are
+            computed only once.
+        start: the fire times are strictly after this aware datetime,
+        end: and not after this one.
+        limit: maximum number of fire times by expression. None means no
+            limit.
+        tz: timezone of the expressions. Default: the current timezone.
+
+    Returns:
+        A dict mapping each expression to its list of fire times. Invalid
+        expressions are mapped to an empty list.
+    """
+    result = {}
+    for expression in expressions:
+        if expression in result:
+            continue
+        try:
+            fire_times = compile_cron(expression).iter(start, end, tz)
+            result[expression] = list(islice(fire_times, limit))
+        except ValueError:
+            result[expression] = []
+    return result
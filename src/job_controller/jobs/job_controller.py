@@ -1,5 +1,8 @@
 import threading
-from django.db.models import F
+import time
+from contextlib import contextmanager
+from django.db import connection, transaction
+from django.db.models import F, Min, Q
 from django.conf import settings
 from django.core.mail import send_mail
 from django.template.loader import render_to_string
@@ -8,7 +11,15 @@ from django.utils.formats import localize
 from django.utils.translation import gettext as _, ngettext
 from django_extensions.management.jobs import BaseJob
 from django_extensions.management.jobs import get_job, get_jobs
-from job_controller.models import Cronjob, JobSchedule
+from job_controller.models import ControllerPhase, Cronjob, JobSchedule
+from job_controller.phases import (
+    LeaseLost,
+    Phase,
+    get_leader_lease,
+    get_phases,
+    time_is_up,
+)
+from job_controller import sharding
 
 WHEN_SETS = {
     "minutely": "* * * * *",
@@ -20,20 +31,311 @@ WHEN_SETS = {
     "yearly": "0 0 1 1 *",
 }
 
+# Name prefix of the threads that run the jobs
+RUN_THREAD_PREFIX = "job-schedule-"
+
+# Minimum number of seconds the controller sleeps when a schedule is already
+# due, giving the threads just started time to mark their schedules as running
+MIN_SLEEP_TIME = 1
+
 
 class Job(BaseJob):
     help = _("Main job controller")
 
+    # Dispatch (run_scheduled) always goes first. Override the options of
+    # each phase with the JOB_CONTROLLER_PHASES setting.
+    #
+    # Each phase is a method called with the `deadline` of its budget and the
+    # `cursor` it returned the last time it ran out of time. It returns None
+    # when it completes, or the cursor to resume from in the next run.
+    phases = [
+        Phase("run_scheduled"),
+        Phase("schedule_jobs"),
+        Phase(
+            "remove_old_jobs", interval=3600, background=True, singleton=True
+        ),
+        Phase(
+            "sync_new_jobs", interval=3600, background=True, singleton=True
+        ),
+        Phase("digest_emails", background=True, singleton=True),
+        Phase(
+            "remove_old_logs", interval=3600, background=True, singleton=True
+        ),
+    ]
+    # Phases that only handle the jobs of this node when sharding is enabled,
+    # so they don't need to run on a single node
+    sharded_phases = [
+        "run_scheduled",
+        "schedule_jobs",
+        "digest_emails",
+        "remove_old_logs",
+    ]
+
+    background_lane = None
+    # Ids of the cron jobs owned by this node, or None to own all jobs
+    shard = None
+
+    def __init__(self):
+        super().__init__()
+        # The (phase name, fencing token) of the lease held by each thread
+        self._lease = threading.local()
+
     def execute(self):
         print(_("Running job controller"))
-        self.remove_old_jobs()
-        self.sync_new_jobs()
-        self.run_scheduled()
-        self.schedule_jobs()
-        self.digest_emails()
-        self.remove_old_logs()
+        if sharding.is_enabled():
+            self.shard = sharding.get_shard()
+            print(
+                "\t",
+                ngettext(
+                    "Node {node} owns one job",
+                    "Node {node} owns {count} jobs",
+                    len(self.shard),
+                ).format(node=sharding.get_node_name(), count=len(self.shard)),
+            )
+        phases = self.get_due_phases()
+        for phase in phases:
+            if not phase.background:
+                self.run_phase(phase)
+        background = [phase for phase in phases if phase.background]
+        if not background:
+            return
+        if self.background_lane is not None and self.background_lane.is_alive():
+            print("\t", _("Background phases still running, skipping them."))
+            return
+        self.background_lane = threading.Thread(
+            target=self._run_background, args=[background]
+        )
+        self.background_lane.start()
+
+    def get_due_phases(self):
+        """
+        Returns the enabled phases whose interval has elapsed
+        """
+        now = timezone.now()
+        last_runs = self.get_last_runs()
+        due = []
+        for phase in get_phases(self.phases):
+            if not phase.enabled:
+                continue
+            if phase.singleton and self.is_sharded(phase):
+                phase = phase.configure(singleton=False)
+            last_run = last_runs.get(self.get_phase_key(phase))
+            if (
+                phase.interval
+                and last_run is not None
+                and last_run + timezone.timedelta(seconds=phase.interval) > now
+            ):
+                continue
+            due.append(phase)
+        return due
+
+    def run_phase(self, phase):
+        """
+        Run `phase`, resuming it where it stopped if it exceeded its budget
+        in the previous run.
+        """
+        started = timezone.now()
+        deadline = phase.get_deadline()
+        token = None
+        if phase.singleton:
+            token = self.acquire_lease(phase)
+            if token is None:
+                print(
+                    "\t",
+                    _(
+                        "Phase {phase} is running on another node or has "
+                        "just run."
+                    ).format(phase=phase.name),
+                )
+                return
+            # Stop before the lease expires and another node takes over
+            lease_deadline = time.monotonic() + get_leader_lease()
+            deadline = min(deadline or lease_deadline, lease_deadline)
+        key = self.get_phase_key(phase)
+        cursor = (
+            ControllerPhase.objects.filter(name=key[0], node=key[1])
+            .values_list("cursor", flat=True)
+            .first()
+        )
+        self._lease.value = None if token is None else (phase.name, token)
+        try:
+            resume = getattr(self, phase.name)(deadline=deadline, cursor=cursor)
+        except LeaseLost:
+            print(
+                "\t\t",
+                _("Phase {phase} stopped: this node lost its lease.").format(
+                    phase=phase.name
+                ),
+            )
+            return
+        finally:
+            self._lease.value = None
+        if resume is not None:
+            print(
+                "\t\t",
+                _(
+                    "Phase {phase} exceeded its time budget and will "
+                    "continue in the next run."
+                ).format(phase=phase.name),
+            )
+            values = {"cursor": resume}
+        else:
+            values = {
+                "last_run": started,
+                "time_spent": timezone.now() - started,
+                "cursor": "",
+            }
+        if token is not None:
+            # Fencing: a node that lost the lease must not record the run
+            ControllerPhase.objects.filter(
+                name=key[0], node=key[1], fencing_token=token
+            ).update(**values)
+        elif phase.interval or resume or cursor:
+            ControllerPhase.objects.update_or_create(
+                name=key[0], node=key[1], defaults=values
+            )
+
+    def is_sharded(self, phase):
+        """
+        Tells if `phase` only handles the jobs of this node
+        """
+        return self.shard is not None and phase.name in self.sharded_phases
+
+    def get_phase_key(self, phase):
+        """
+        Returns the (name, node) key of the ControllerPhase of `phase`. Each
+        node records its own runs of the sharded phases, since they only
+        handle the jobs of the node.
+        """
+        if self.is_sharded(phase):
+            return (phase.name, sharding.get_node_name())
+        return (phase.name, "")
+
+    def get_last_runs(self):
+        return {
+            (name, node): last_run
+            for name, node, last_run in ControllerPhase.objects.values_list(
+                "name", "node", "last_run"
+            )
+        }
+
+    def acquire_lease(self, phase):
+        """
+        Acquire or renew the lease of this node on the singleton `phase`.
 
-    def remove_old_jobs(self):
+        The interval of the phase is checked again while acquiring the
+        lease, since another node may have run the phase after this one read
+        its last run.
+
+        Returns:
+            The fencing token of the lease, or None if another node holds it
+            or the phase is no longer due.
+        """
+        node = sharding.get_node_name()
+        now = timezone.now()
+        due = Q()
+        if phase.interval:
+            due = Q(last_run=None) | Q(
+                last_run__lte=now - timezone.timedelta(seconds=phase.interval)
+            )
+        ControllerPhase.objects.get_or_create(name=phase.name, node="")
+        if not ControllerPhase.objects.filter(
+            Q(leader=node) | Q(lease_expires=None) | Q(lease_expires__lt=now),
+            due,
+            name=phase.name,
+            node="",
+        ).update(
+            leader=node,
+            lease_expires=now + timezone.timedelta(seconds=get_leader_lease()),
+            fencing_token=F("fencing_token") + 1,
+        ):
+            return None
+        return ControllerPhase.objects.values_list(
+            "fencing_token", flat=True
+        ).get(name=phase.name, node="")
+
+    @contextmanager
+    def fenced(self):
+        """
+        Transaction for the writes of a phase. In a singleton phase, it
+        first checks that this node still holds the lease, which stays
+        locked until the end of the transaction, so that no other node can
+        take it over meanwhile.
+
+        Raises:
+            LeaseLost: if another node took the lease over.
+        """
+        lease = getattr(self._lease, "value", None)
+        with transaction.atomic():
+            if lease is not None:
+                name, token = lease
+                if not ControllerPhase.objects.filter(
+                    name=name,
+                    node="",
+                    fencing_token=token,
+                    lease_expires__gt=timezone.now(),
+                ).update(fencing_token=token):
+                    raise LeaseLost()
+            yield
+
+    def get_cronjobs(self):
+        """
+        Returns the cron jobs handled by this node
+        """
+        if self.shard is None:
+            return Cronjob.objects.all()
+        return Cronjob.objects.filter(pk__in=self.shard)
+
+    def _run_background(self, phases):
+        try:
+            for phase in phases:
+                self.run_phase(phase)
+        finally:
+            connection.close()
+
+    def get_sleep_time(self):
+        """
+        Returns how many seconds the controller can sleep before something
+        has to be done, or None if nothing is due.
+        """
+        now = timezone.now()
+        # Schedules may fall due after run_scheduled, while the other phases
+        # run, so the schedules already due are also taken into account
+        wakeups = []
+        next_start = JobSchedule.objects.filter(
+            job__in=self.get_cronjobs(),
+            status=JobSchedule.STATUS_SCHEDULED,
+        ).aggregate(next_start=Min("start"))["next_start"]
+        if next_start is not None:
+            wakeups.append(next_start)
+        for job in (
+            self.get_cronjobs()
+            .exclude(email_recipient="")
+            .exclude(last_digest=None)
+        ):
+            digest_time = job.last_digest + timezone.timedelta(
+                days=job.digest_days
+            )
+            if digest_time > now:
+                wakeups.append(digest_time)
+        last_runs = self.get_last_runs()
+        for phase in get_phases(self.phases):
+            last_run = last_runs.get(self.get_phase_key(phase))
+            if not (phase.enabled and phase.interval and last_run):
+                continue
+            phase_time = last_run + timezone.timedelta(seconds=phase.interval)
+            if phase_time > now:
+                wakeups.append(phase_time)
+        if sharding.is_enabled():
+            # Renew the lease before it expires
+            wakeups.append(
+                now + timezone.timedelta(seconds=sharding.get_lease() / 3)
+            )
+        if not wakeups:
+            return None
+        return max((min(wakeups) - now).total_seconds(), MIN_SLEEP_TIME)
+
+    def remove_old_jobs(self, deadline=None, cursor=None):
         """
         Remove from the jobs table those that were removed from the code
         """
@@ -49,11 +351,13 @@ class Job(BaseJob):
         excludes = Cronjob.objects.all()
         for app_name, job_name in all_jobs.keys():
             excludes = excludes.exclude(app_name=app_name, job_name=job_name)
-        print("\t\t", excludes.delete())
+        with self.fenced():
+            print("\t\t", excludes.delete())
 
-    def sync_new_jobs(self):
+    def sync_new_jobs(self, deadline=None, cursor=None):
         """
-        Update the jobs table with the new jobs that have been created
+        Update the jobs table with the new jobs that have been created, and
+        schedule them at once
         """
         print(
             "\t",
@@ -63,7 +367,14 @@ class Job(BaseJob):
             ),
         )
         all_jobs = get_jobs()
-        for (app_name, job_name), JobClass in all_jobs.items():
+        for (app_name, job_name), JobClass in sorted(
+            all_jobs.items(), key=lambda item: ".".join(item[0])
+        ):
+            key = f"{app_name}.{job_name}"
+            if cursor and key < cursor:
+                continue
+            if time_is_up(deadline):
+                return key
             # Ignore job_controller
             if app_name == "job_controller" and job_name == "job_controller":
                 continue
@@ -81,7 +392,9 @@ class Job(BaseJob):
                     job_name=job_name,
                     cron_expression=cron_expression,
                 )
-                job.save()
+                with self.fenced():
+                    job.save()
+                    job.next_schedule()
                 print(
                     "\t\t",
                     _("New job found at {app_name}: {job_name}: {help}").format(
@@ -89,14 +402,23 @@ class Job(BaseJob):
                     ),
                 )
 
-    def run_scheduled(self):
+    def run_scheduled(self, deadline=None, cursor=None):
         """Run scheduled jobs"""
         print("\t", _("Run scheduled jobs..."))
         for schedule in JobSchedule.objects.filter(
+            job__in=self.get_cronjobs(),
             status=JobSchedule.STATUS_SCHEDULED,
             start__lte=timezone.localtime(),
         ):
-            thread = threading.Thread(target=self._job_starter, args=[schedule])
+            if time_is_up(deadline):
+                # Started schedules are no longer due, so the next run
+                # continues with the remaining ones
+                return ""
+            thread = threading.Thread(
+                target=self._job_starter,
+                args=[schedule],
+                name=f"{RUN_THREAD_PREFIX}{schedule.pk}",
+            )
             thread.start()
 
     def _job_starter(self, schedule):
@@ -129,15 +451,19 @@ class Job(BaseJob):
             ),
         )
 
-    def schedule_jobs(self):
+    def schedule_jobs(self, deadline=None, cursor=None):
         """Create schedule for next run"""
         print("\t", _("Create schedule for next run..."))
-        for job in Cronjob.objects.exclude(
+        for job in self.get_cronjobs().exclude(
             jobschedule__status__in=[
                 JobSchedule.STATUS_SCHEDULED,
                 JobSchedule.STATUS_RUNNING,
             ]
         ):
+            if time_is_up(deadline):
+                # Scheduled jobs are excluded, so the next run continues
+                # with the remaining ones
+                return ""
             schedule = job.next_schedule()
             print(
                 "\t\t",
@@ -147,18 +473,24 @@ class Job(BaseJob):
                 ),
             )
 
-    def remove_old_logs(self):
+    def remove_old_logs(self, deadline=None, cursor=None):
         print("\t", _("Delete old logs..."))
-        for job in Cronjob.objects.exclude(log_duration=0):
+        jobs = self.get_cronjobs().exclude(log_duration=0).order_by("pk")
+        if cursor:
+            jobs = jobs.filter(pk__gte=cursor)
+        for job in jobs:
+            if time_is_up(deadline):
+                return str(job.pk)
             limit_time = timezone.localtime() - timezone.timedelta(
                 days=job.log_duration
             )
-            result = JobSchedule.objects.filter(
-                job=job,
-                status=JobSchedule.STATUS_FINISHED,
-                started__lt=limit_time,
-                reported=True,
-            ).delete()
+            with self.fenced():
+                result = JobSchedule.objects.filter(
+                    job=job,
+                    status=JobSchedule.STATUS_FINISHED,
+                    started__lt=limit_time,
+                    reported=True,
+                ).delete()
             if result[0] > 0:
                 print(
                     "\t\t",
@@ -169,12 +501,16 @@ class Job(BaseJob):
                     ).format(job=job, count=result[0]),
                 )
 
-    def digest_emails(self):
+    def digest_emails(self, deadline=None, cursor=None):
         """Generate log summary and send by email"""
         print("\t", _("Generate log summary and send by email..."))
         now = timezone.now()
-        jobs = Cronjob.objects.exclude(email_recipient="")
+        jobs = self.get_cronjobs().exclude(email_recipient="").order_by("pk")
+        if cursor:
+            jobs = jobs.filter(pk__gte=cursor)
         for job in jobs:
+            if time_is_up(deadline):
+                return str(job.pk)
             if not (
                 job.last_digest is None
                 or job.last_digest
@@ -190,6 +526,13 @@ class Job(BaseJob):
                 rounds = all_rounds.all()
             if not rounds.exists():
                 continue
+            # Claim the digest, so that no other node sends it again
+            with self.fenced():
+                claimed = Cronjob.objects.filter(
+                    pk=job.pk, last_digest=job.last_digest
+                ).update(last_digest=now)
+            if not claimed:
+                continue
             context = {
                 "job": job,
                 "rounds": rounds,
@@ -211,5 +554,3 @@ class Job(BaseJob):
                 html_message=html_message,
             )
             all_rounds.update(reported=True)
-            job.last_digest = timezone.now()
-            job.save()
@@ -0,0 +1,49 @@
+import time
+import traceback
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils.translation import gettext as _
+from job_controller.jobs.job_controller import Job
+from job_controller.notify import Listener
+
+# Seconds to wait before running the job controller again after an error
+ERROR_SLEEP_TIME = 10
+
+
+class Command(BaseCommand):
+    help = _(
+        "Run the job controller as a resident process that wakes up when "
+        "a job is due or when cron jobs and schedules are changed"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-sleep",
+            type=float,
+            default=None,
+            help=_(
+                "Maximum number of seconds to sleep between two job "
+                "controller runs. Default: sleep until something changes."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        max_sleep = options["max_sleep"]
+        controller = Job()
+        with Listener() as listener:
+            while True:
+                try:
+                    controller.execute()
+                    timeout = controller.get_sleep_time()
+                    if timeout is None:
+                        timeout = max_sleep
+                    elif max_sleep is not None:
+                        timeout = min(timeout, max_sleep)
+                    listener.wait(timeout)
+                except Exception:
+                    # Like the next cron run would, try again later: a lost
+                    # database connection or a locked database must not
+                    # stop the job controller
+                    self.stderr.write(traceback.format_exc())
+                    connection.close_if_unusable_or_obsolete()
+                    time.sleep(ERROR_SLEEP_TIME)
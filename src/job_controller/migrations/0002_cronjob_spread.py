@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('job_controller', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cronjob',
+            name='spread_mode',
+            field=models.CharField(choices=[('N', 'No spreading'), ('J', 'Deterministic jitter'), ('P', 'Spread evenly with other jobs')], default='N', help_text='How to delay the start of this job to avoid running it at the same moment as the other jobs with the same CRON instant.<br/><strong>Deterministic jitter</strong> always delays the job by the same amount, derived from the app and job names.<br/><strong>Spread evenly</strong> divides the window between all jobs using this mode that share the same CRON instant.', max_length=1, verbose_name='load spreading'),
+        ),
+        migrations.AddField(
+            model_name='cronjob',
+            name='spread_window',
+            field=models.PositiveIntegerField(default=300, help_text='Maximum delay, in seconds, applied to the CRON instant when load spreading is enabled.', verbose_name='spread window (seconds)'),
+        ),
+        migrations.AddField(
+            model_name='jobschedule',
+            name='offset',
+            field=models.DurationField(blank=True, editable=False, null=True, verbose_name='delay after the CRON instant'),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:20
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("job_controller", "0002_cronjob_spread"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cronjob",
+            name="retry_attempts",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="How many times a failed run will be retried before waiting for the next CRON instant. Zero means failed runs are not retried.",
+                validators=[django.core.validators.MaxValueValidator(100)],
+                verbose_name="retry attempts",
+            ),
+        ),
+        migrations.AddField(
+            model_name="cronjob",
+            name="retry_backoff",
+            field=models.FloatField(
+                default=2.0,
+                help_text="The delay is multiplied by this factor at each new retry.",
+                validators=[
+                    django.core.validators.MinValueValidator(1.0),
+                    django.core.validators.MaxValueValidator(10.0),
+                ],
+                verbose_name="retry backoff factor",
+            ),
+        ),
+        migrations.AddField(
+            model_name="cronjob",
+            name="retry_delay",
+            field=models.PositiveIntegerField(
+                default=60,
+                help_text="Seconds to wait before the first retry.",
+                verbose_name="retry delay (seconds)",
+            ),
+        ),
+        migrations.AddField(
+            model_name="cronjob",
+            name="retry_max_delay",
+            field=models.PositiveIntegerField(
+                default=3600,
+                help_text="The retry delay never grows beyond this value.",
+                verbose_name="maximum retry delay (seconds)",
+            ),
+        ),
+        migrations.AddField(
+            model_name="cronjob",
+            name="retry_jitter",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Maximum random number of seconds added to each retry delay.",
+                verbose_name="retry jitter (seconds)",
+            ),
+        ),
+        migrations.AddField(
+            model_name="jobschedule",
+            name="attempt",
+            field=models.PositiveIntegerField(
+                default=1, editable=False, verbose_name="attempt"
+            ),
+        ),
+        migrations.AddField(
+            model_name="jobschedule",
+            name="retry_of",
+            field=models.ForeignKey(
+                blank=True,
+                editable=False,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="retries",
+                to="job_controller.jobschedule",
+                verbose_name="retry of",
+            ),
+        ),
+    ]
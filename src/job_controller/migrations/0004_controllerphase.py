@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("job_controller", "0003_retry_backoff"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ControllerPhase",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "name",
+                    models.CharField(
+                        editable=False,
+                        max_length=100,
+                        unique=True,
+                        verbose_name="phase",
+                    ),
+                ),
+                (
+                    "last_run",
+                    models.DateTimeField(
+                        blank=True, editable=False, null=True, verbose_name="last run"
+                    ),
+                ),
+                (
+                    "time_spent",
+                    models.DurationField(
+                        blank=True,
+                        editable=False,
+                        null=True,
+                        verbose_name="time spent on last run",
+                    ),
+                ),
+                (
+                    "cursor",
+                    models.CharField(
+                        blank=True,
+                        editable=False,
+                        max_length=255,
+                        verbose_name="resume from",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "controller phase",
+                "verbose_name_plural": "controller phases",
+                "ordering": ("name",),
+            },
+        ),
+    ]
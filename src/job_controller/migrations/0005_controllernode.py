@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("job_controller", "0004_controllerphase"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ControllerNode",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "name",
+                    models.CharField(
+                        editable=False, max_length=255, unique=True, verbose_name="node"
+                    ),
+                ),
+                (
+                    "joined",
+                    models.DateTimeField(editable=False, verbose_name="joined at"),
+                ),
+                (
+                    "heartbeat",
+                    models.DateTimeField(editable=False, verbose_name="last heartbeat"),
+                ),
+            ],
+            options={
+                "verbose_name": "controller node",
+                "verbose_name_plural": "controller nodes",
+                "ordering": ("name",),
+            },
+        ),
+        migrations.AlterModelOptions(
+            name="controllerphase",
+            options={
+                "ordering": ("name", "node"),
+                "verbose_name": "controller phase",
+                "verbose_name_plural": "controller phases",
+            },
+        ),
+        migrations.AddField(
+            model_name="controllerphase",
+            name="node",
+            field=models.CharField(
+                blank=True,
+                editable=False,
+                help_text="Node whose jobs the phase handles, for phases run by each node on its own jobs. Empty for the other phases.",
+                max_length=255,
+                verbose_name="node",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="controllerphase",
+            name="name",
+            field=models.CharField(
+                editable=False, max_length=100, verbose_name="phase"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="controllerphase",
+            constraint=models.UniqueConstraint(
+                fields=("name", "node"), name="unique_phase_node"
+            ),
+        ),
+    ]
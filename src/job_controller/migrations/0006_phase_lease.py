@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("job_controller", "0005_controllernode"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="controllerphase",
+            name="fencing_token",
+            field=models.PositiveBigIntegerField(
+                default=0, editable=False, verbose_name="fencing token"
+            ),
+        ),
+        migrations.AddField(
+            model_name="controllerphase",
+            name="leader",
+            field=models.CharField(
+                blank=True, editable=False, max_length=255, verbose_name="leader node"
+            ),
+        ),
+        migrations.AddField(
+            model_name="controllerphase",
+            name="lease_expires",
+            field=models.DateTimeField(
+                blank=True, editable=False, null=True, verbose_name="lease expires at"
+            ),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("job_controller", "0006_phase_lease"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="jobschedule",
+            name="cpu_system",
+            field=models.DurationField(
+                blank=True, editable=False, null=True, verbose_name="system CPU time"
+            ),
+        ),
+        migrations.AddField(
+            model_name="jobschedule",
+            name="cpu_user",
+            field=models.DurationField(
+                blank=True, editable=False, null=True, verbose_name="user CPU time"
+            ),
+        ),
+        migrations.AddField(
+            model_name="jobschedule",
+            name="output_bytes",
+            field=models.PositiveBigIntegerField(
+                blank=True,
+                editable=False,
+                null=True,
+                verbose_name="output size (bytes)",
+            ),
+        ),
+        migrations.AddField(
+            model_name="jobschedule",
+            name="peak_memory",
+            field=models.BigIntegerField(
+                blank=True,
+                editable=False,
+                null=True,
+                verbose_name="peak memory growth (bytes)",
+            ),
+        ),
+        migrations.AddField(
+            model_name="jobschedule",
+            name="queries",
+            field=models.PositiveIntegerField(
+                blank=True, editable=False, null=True, verbose_name="SQL queries"
+            ),
+        ),
+        migrations.AddField(
+            model_name="jobschedule",
+            name="query_time",
+            field=models.DurationField(
+                blank=True,
+                editable=False,
+                null=True,
+                verbose_name="time spent on SQL queries",
+            ),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("job_controller", "0007_resource_usage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="cronjob",
+            name="profile_every",
+            field=models.PositiveIntegerField(
+                default=0,
+                help_text="Profile, on average, one in this number of runs. Zero means runs are not profiled.",
+                verbose_name="profile one in N runs",
+            ),
+        ),
+        migrations.AddField(
+            model_name="cronjob",
+            name="profile_next_run",
+            field=models.BooleanField(
+                default=False,
+                help_text="Profile the next run of this job. Unchecked automatically after the run.",
+                verbose_name="profile next run",
+            ),
+        ),
+        migrations.CreateModel(
+            name="JobProfile",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("data", models.BinaryField(verbose_name="compressed profile")),
+                (
+                    "schedule",
+                    models.OneToOneField(
+                        editable=False,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="profile",
+                        to="job_controller.jobschedule",
+                        verbose_name="run schedule",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "run profile",
+                "verbose_name_plural": "run profiles",
+            },
+        ),
+    ]
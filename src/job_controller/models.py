@@ -1,19 +1,32 @@
-import io
-from contextlib import redirect_stderr, redirect_stdout
-from cron_converter import Cron
+import random
+import zlib
+from contextlib import nullcontext
 from datetime import timedelta
 from django.conf import settings
 from django.contrib import admin
 from django.core.mail import send_mail
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models, transaction, utils
 from django.utils import timezone
 from django.utils.formats import localize
 from django.utils.html import format_html
 from django.utils.translation import gettext as _, ngettext
 from django_extensions.management.jobs import get_job, get_jobs
+from .accounting import ResourceUsage
+from .capture import capture_output
+from .cron import compile_cron
+from .profiling import PROFILES_ALL_THREADS, JobProfiler
 
 
 class Cronjob(models.Model):
+    SPREAD_NONE = "N"
+    SPREAD_JITTER = "J"
+    SPREAD_PLANNED = "P"
+    SPREAD_CHOICES = (
+        (SPREAD_NONE, _("No spreading")),
+        (SPREAD_JITTER, _("Deterministic jitter")),
+        (SPREAD_PLANNED, _("Spread evenly with other jobs")),
+    )
     app_name = models.CharField(_("app"), max_length=100, editable=False)
     job_name = models.CharField(_("job"), max_length=100, editable=False)
     cron_expression = models.CharField(
@@ -64,6 +77,78 @@ class Cronjob(models.Model):
     last_digest = models.DateTimeField(
         _("last digest submission"), blank=True, null=True, editable=False
     )
+    spread_mode = models.CharField(
+        _("load spreading"),
+        max_length=1,
+        choices=SPREAD_CHOICES,
+        default=SPREAD_NONE,
+        help_text=_(
+            "How to delay the start of this job to avoid running it at the "
+            "same moment as the other jobs with the same CRON instant.<br/>"
+            "<strong>Deterministic jitter</strong> always delays the job by "
+            "the same amount, derived from the app and job names.<br/>"
+            "<strong>Spread evenly</strong> divides the window between all "
+            "jobs using this mode that share the same CRON instant."
+        ),
+    )
+    spread_window = models.PositiveIntegerField(
+        _("spread window (seconds)"),
+        default=300,
+        help_text=_(
+            "Maximum delay, in seconds, applied to the CRON instant when "
+            "load spreading is enabled."
+        ),
+    )
+    retry_attempts = models.PositiveIntegerField(
+        _("retry attempts"),
+        default=0,
+        validators=[MaxValueValidator(100)],
+        help_text=_(
+            "How many times a failed run will be retried before waiting for "
+            "the next CRON instant. Zero means failed runs are not retried."
+        ),
+    )
+    retry_delay = models.PositiveIntegerField(
+        _("retry delay (seconds)"),
+        default=60,
+        help_text=_("Seconds to wait before the first retry."),
+    )
+    retry_backoff = models.FloatField(
+        _("retry backoff factor"),
+        default=2.0,
+        validators=[MinValueValidator(1.0), MaxValueValidator(10.0)],
+        help_text=_(
+            "The delay is multiplied by this factor at each new retry."
+        ),
+    )
+    retry_max_delay = models.PositiveIntegerField(
+        _("maximum retry delay (seconds)"),
+        default=3600,
+        help_text=_("The retry delay never grows beyond this value."),
+    )
+    retry_jitter = models.PositiveIntegerField(
+        _("retry jitter (seconds)"),
+        default=0,
+        help_text=_(
+            "Maximum random number of seconds added to each retry delay."
+        ),
+    )
+    profile_next_run = models.BooleanField(
+        _("profile next run"),
+        default=False,
+        help_text=_(
+            "Profile the next run of this job. Unchecked automatically "
+            "after the run."
+        ),
+    )
+    profile_every = models.PositiveIntegerField(
+        _("profile one in N runs"),
+        default=0,
+        help_text=_(
+            "Profile, on average, one in this number of runs. "
+            "Zero means runs are not profiled."
+        ),
+    )
 
     def get_emails_list(self):
         return [
@@ -98,7 +183,18 @@ class Cronjob(models.Model):
     def __str__(self):
         return self.job_name
 
-    def run(self):
+    def run(self, usage=None, profiler=None):
+        """
+        Run the job, capturing its output.
+
+        Args:
+            usage: optional ResourceUsage to measure the resources used by
+                the job.
+            profiler: optional JobProfiler to profile the job.
+
+        Returns:
+            A (has_errors, report) tuple.
+        """
         try:
             JobClass = get_job(self.app_name, self.job_name)
         except KeyError:
@@ -111,14 +207,15 @@ class Cronjob(models.Model):
             )
         try:
             job_obj = JobClass()
-            with io.StringIO() as so_buf, io.StringIO() as se_buf, redirect_stdout(
-                so_buf
-            ), redirect_stderr(
-                se_buf
-            ):
-                job_obj.execute()
-                messages = so_buf.getvalue()
-                errors = se_buf.getvalue()
+            with capture_output() as (stdout, stderr):
+                with usage or nullcontext(), profiler or nullcontext():
+                    job_obj.execute()
+            messages = stdout.getvalue()
+            errors = stderr.getvalue()
+            if usage is not None:
+                usage.output_bytes = len(messages.encode()) + len(
+                    errors.encode()
+                )
             report_data = []
             if messages:
                 report_data.extend(["", "MESSAGES", "--------", ""])
@@ -148,15 +245,97 @@ class Cronjob(models.Model):
                 ]
             )
         except JobSchedule.DoesNotExist:
-            start = self.get_next_schedule_time()
-            schedule = JobSchedule(job=self, start=start)
+            now = timezone.localtime()
+            start = self.get_next_schedule_time(now)
+            offset = self.get_start_offset(start)
+            schedule = JobSchedule(
+                job=self, start=start + offset, offset=offset
+            )
             schedule.save()
         return schedule
 
-    def get_next_schedule_time(self):
-        cron_instance = Cron(self.cron_expression)
-        scheduller = cron_instance.schedule(timezone.localtime())
-        return scheduller.next()
+    def reschedule(self):
+        """
+        Replace the pending schedule of this job, so that changes of its
+        CRON expression or load spreading apply to the next run. Retries and
+        schedules already due are kept.
+
+        Raises:
+            ValueError: if the CRON expression is invalid. The pending
+            schedule is kept in that case.
+        """
+        with transaction.atomic():
+            self.jobschedule_set.filter(
+                status=JobSchedule.STATUS_SCHEDULED,
+                retry_of=None,
+                start__gt=timezone.now(),
+            ).delete()
+            return self.next_schedule()
+
+    def get_next_schedule_time(self, now=None):
+        if now is None:
+            now = timezone.localtime()
+        return compile_cron(self.cron_expression).next(now)
+
+    def get_start_offset(self, start):
+        """
+        Returns the delay to add to the CRON instant `start` according to
+        the load spreading mode of this job. The delay is always shorter than
+        the time until the following CRON instant.
+        """
+        if self.spread_mode == Cronjob.SPREAD_NONE or self.spread_window == 0:
+            return timedelta(0)
+        # The delayed run must start before the following CRON instant,
+        # otherwise the job would skip instants and run less often
+        following = compile_cron(self.cron_expression).next(start)
+        window = min(
+            self.spread_window, int((following - start).total_seconds())
+        )
+        if self.spread_mode == Cronjob.SPREAD_JITTER:
+            key = f"{self.app_name}.{self.job_name}".encode()
+            return timedelta(seconds=zlib.crc32(key) % window)
+        # SPREAD_PLANNED: share the window evenly among the jobs that fire
+        # at the same CRON instant
+        siblings = {(self.app_name, self.job_name)}
+        for job in Cronjob.objects.filter(
+            spread_mode=Cronjob.SPREAD_PLANNED
+        ).exclude(pk=self.pk):
+            try:
+                cron = compile_cron(job.cron_expression)
+                if cron.next(start - timedelta(minutes=1)) == start:
+                    siblings.add((job.app_name, job.job_name))
+            except ValueError:
+                # Invalid CRON expressions of other jobs are not our business
+                continue
+        slot = sorted(siblings).index((self.app_name, self.job_name))
+        return timedelta(seconds=window * slot // len(siblings))
+
+    def should_profile(self):
+        """
+        Tells if the next run must be profiled, consuming the "profile next
+        run" request.
+        """
+        if self.profile_next_run:
+            Cronjob.objects.filter(pk=self.pk).update(profile_next_run=False)
+            self.profile_next_run = False
+            return True
+        return bool(self.profile_every) and (
+            random.randrange(self.profile_every) == 0
+        )
+
+    def get_retry_delay(self, retry):
+        """
+        Returns the time to wait before the retry number `retry` (starting
+        from 1) of a failed run.
+        """
+        try:
+            seconds = self.retry_delay * self.retry_backoff ** (retry - 1)
+        except OverflowError:
+            seconds = self.retry_max_delay
+        seconds = min(seconds, self.retry_max_delay)
+        if self.retry_jitter:
+            seconds += random.uniform(0, self.retry_jitter)
+        return timedelta(seconds=seconds)
 
 
 class JobSchedule(models.Model):
@@ -185,6 +364,42 @@ class JobSchedule(models.Model):
     result = models.TextField(_("execution result"), blank=True, editable=False)
     has_errors = models.BooleanField(_("has errors"), null=True, editable=False)
     reported = models.BooleanField(default=False, editable=False)
+    offset = models.DurationField(
+        _("delay after the CRON instant"),
+        blank=True,
+        null=True,
+        editable=False,
+    )
+    retry_of = models.ForeignKey(
+        "self",
+        verbose_name=_("retry of"),
+        related_name="retries",
+        blank=True,
+        null=True,
+        editable=False,
+        on_delete=models.SET_NULL,
+    )
+    attempt = models.PositiveIntegerField(
+        _("attempt"), default=1, editable=False
+    )
+    cpu_user = models.DurationField(
+        _("user CPU time"), blank=True, null=True, editable=False
+    )
+    cpu_system = models.DurationField(
+        _("system CPU time"), blank=True, null=True, editable=False
+    )
+    peak_memory = models.BigIntegerField(
+        _("peak memory growth (bytes)"), blank=True, null=True, editable=False
+    )
+    queries = models.PositiveIntegerField(
+        _("SQL queries"), blank=True, null=True, editable=False
+    )
+    query_time = models.DurationField(
+        _("time spent on SQL queries"), blank=True, null=True, editable=False
+    )
+    output_bytes = models.PositiveBigIntegerField(
+        _("output size (bytes)"), blank=True, null=True, editable=False
+    )
 
     class Meta:
         ordering = ("-start",)
@@ -292,9 +507,140 @@ class JobSchedule(models.Model):
         JobSchedule.__prepare_to_run(self.pk)
         self.refresh_from_db()
 
-        has_errors, result = self.job.run()
-        self.result = result
-        self.has_errors = has_errors
-        self.status = JobSchedule.STATUS_FINISHED
-        self.time_spent = timezone.localtime() - self.started
-        self.save()
+        usage = ResourceUsage()
+        profiler = JobProfiler() if self.job.should_profile() else None
+        has_errors, result = self.job.run(usage, profiler)
+        with transaction.atomic():
+            self.result = result
+            self.has_errors = has_errors
+            for field, value in usage.as_dict().items():
+                setattr(self, field, value)
+            self.status = JobSchedule.STATUS_FINISHED
+            self.time_spent = timezone.localtime() - self.started
+            if profiler is not None:
+                data = profiler.dump()
+                if data is None:
+                    self.result += "\n\n" + _(
+                        "The run could not be profiled: {error}"
+                    ).format(error=profiler.error)
+                else:
+                    JobProfile.objects.create(schedule=self, data=data)
+                    if PROFILES_ALL_THREADS:
+                        self.result += "\n\n" + _(
+                            "The profile also includes the code run by "
+                            "other threads during the run."
+                        )
+            self.save()
+            if has_errors:
+                try:
+                    # A failing retry must not undo the end of this run
+                    with transaction.atomic():
+                        self.schedule_retry()
+                except Exception as e:
+                    self.result += "\n\n" + _(
+                        "The run could not be retried: {error}"
+                    ).format(error=e)
+                    self.save(update_fields=["result"])
+
+    def schedule_retry(self):
+        """
+        Create a new schedule to retry this failed run, if the job still has
+        retry attempts left.
+
+        The retry is a regular scheduled run, so it is started by the job
+        controller like any other schedule and takes the place of the next
+        schedule of the job until it runs.
+
+        Returns:
+            The new JobSchedule or None if no more retries are allowed.
+        """
+        if self.attempt > self.job.retry_attempts:
+            return None
+        delay = self.job.get_retry_delay(self.attempt)
+        retry = JobSchedule(
+            job=self.job,
+            start=timezone.localtime() + delay,
+            retry_of=self.retry_of or self,
+            attempt=self.attempt + 1,
+        )
+        retry.save()
+        return retry
+
+
+class JobProfile(models.Model):
+    schedule = models.OneToOneField(
+        JobSchedule,
+        verbose_name=_("run schedule"),
+        related_name="profile",
+        on_delete=models.CASCADE,
+        editable=False,
+    )
+    data = models.BinaryField(_("compressed profile"), editable=False)
+
+    class Meta:
+        verbose_name = _("run profile")
+        verbose_name_plural = _("run profiles")
+
+    def __str__(self):
+        return str(self.schedule)
+
+
+class ControllerPhase(models.Model):
+    name = models.CharField(_("phase"), max_length=100, editable=False)
+    node = models.CharField(
+        _("node"),
+        max_length=255,
+        blank=True,
+        editable=False,
+        help_text=_(
+            "Node whose jobs the phase handles, for phases run by each node "
+            "on its own jobs. Empty for the other phases."
+        ),
+    )
+    last_run = models.DateTimeField(
+        _("last run"), blank=True, null=True, editable=False
+    )
+    time_spent = models.DurationField(
+        _("time spent on last run"), blank=True, null=True, editable=False
+    )
+    leader = models.CharField(
+        _("leader node"), max_length=255, blank=True, editable=False
+    )
+    lease_expires = models.DateTimeField(
+        _("lease expires at"), blank=True, null=True, editable=False
+    )
+    fencing_token = models.PositiveBigIntegerField(
+        _("fencing token"), default=0, editable=False
+    )
+    cursor = models.CharField(
+        _("resume from"), max_length=255, blank=True, editable=False
+    )
+
+    class Meta:
+        ordering = ("name", "node")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["name", "node"], name="unique_phase_node"
+            )
+        ]
+        verbose_name = _("controller phase")
+        verbose_name_plural = _("controller phases")
+
+    def __str__(self):
+        return self.name
+
+
+class ControllerNode(models.Model):
+    name = models.CharField(
+        _("node"), max_length=255, unique=True, editable=False
+    )
+    joined = models.DateTimeField(_("joined at"), editable=False)
+    heartbeat = models.DateTimeField(_("last heartbeat"), editable=False)
+
+    class Meta:
+        ordering = ("name",)
+        verbose_name = _("controller node")
+        verbose_name_plural = _("controller nodes")
+
+    def __str__(self):
+        return self.name
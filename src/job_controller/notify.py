@@ -0,0 +1,163 @@
+"""
+Change notifications used to wake up the resident job controller.
+
+On PostgreSQL, changes are published with ``NOTIFY`` and received with
+``LISTEN`` on the controller connection. On other databases, changes are sent
+as datagrams to the Unix socket defined by the ``JOB_CONTROLLER_SOCKET``
+setting, if any. Changes made in the controller process itself (e.g. by the
+threads that run the jobs) always wake it up through an internal pipe.
+"""
+
+import os
+import select
+import socket
+from django.conf import settings
+from django.db import connection
+
+CHANNEL = "job_controller"
+
+# Pipe used to wake up the listener from the same process
+_wakeup_fds = None
+
+
+def get_socket_path():
+    return getattr(settings, "JOB_CONTROLLER_SOCKET", None)
+
+
+def notify():
+    """
+    Tell the job controller that cron jobs or schedules have changed.
+    """
+    if _wakeup_fds is not None:
+        try:
+            os.write(_wakeup_fds[1], b"1")
+        except BlockingIOError:
+            # The pipe is full, so the listener will wake up anyway
+            pass
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, '')", [CHANNEL])
+        return
+    path = get_socket_path()
+    if path:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            try:
+                sock.sendto(b"1", path)
+            except OSError:
+                # There is no job controller listening
+                pass
+
+
+class Listener:
+    """
+    Waits for change notifications. Use it as a context manager::
+
+        with Listener() as listener:
+            while True:
+                ...
+                listener.wait(timeout)
+    """
+
+    def __init__(self):
+        self.sock = None
+        self.pending = False
+        # Database connection subscribed to the channel
+        self.raw = None
+
+    def __enter__(self):
+        global _wakeup_fds
+        if _wakeup_fds is None:
+            _wakeup_fds = os.pipe()
+            os.set_blocking(_wakeup_fds[0], False)
+            os.set_blocking(_wakeup_fds[1], False)
+        if connection.vendor == "postgresql":
+            self._listen()
+        else:
+            path = get_socket_path()
+            if path:
+                if os.path.exists(path):
+                    os.unlink(path)
+                self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                self.sock.setblocking(False)
+                self.sock.bind(path)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if connection.vendor == "postgresql":
+            if connection.connection is not None:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"UNLISTEN {CHANNEL}")
+        elif self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            os.unlink(get_socket_path())
+
+    def _listen(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {CHANNEL}")
+        self.raw = connection.connection
+        if hasattr(self.raw, "add_notify_handler"):
+            # psycopg 3 delivers notifications to handlers
+            self.raw.add_notify_handler(self._on_notify)
+
+    def _on_notify(self, notification):
+        self.pending = True
+
+    def _consume(self):
+        """
+        Read all pending notifications. Returns True if there was any.
+        """
+        received = self.pending
+        self.pending = False
+        try:
+            while os.read(_wakeup_fds[0], 1024):
+                received = True
+        except BlockingIOError:
+            pass
+        if self.sock is not None:
+            try:
+                while True:
+                    self.sock.recv(1024)
+                    received = True
+            except BlockingIOError:
+                pass
+        if connection.vendor == "postgresql":
+            raw = connection.connection
+            if hasattr(raw, "add_notify_handler"):
+                raw.execute("SELECT 1")
+                received = received or self.pending
+                self.pending = False
+            else:
+                raw.poll()
+                received = received or bool(raw.notifies)
+                raw.notifies.clear()
+        return received
+
+    def wait(self, timeout=None):
+        """
+        Sleep until a change notification arrives or `timeout` seconds have
+        passed. `None` means wait forever.
+
+        Returns:
+            True if a notification was received, False on timeout.
+        """
+        if connection.vendor == "postgresql" and (
+            connection.connection is None
+            or connection.connection is not self.raw
+        ):
+            # The connection was closed, after an error for instance. The
+            # new one must listen again, and the notifications sent
+            # meanwhile are lost, so tell the caller something has changed.
+            self._listen()
+            return True
+        if self._consume():
+            return True
+        fds = [_wakeup_fds[0]]
+        if self.sock is not None:
+            fds.append(self.sock)
+        if connection.vendor == "postgresql":
+            fds.append(connection.connection.fileno())
+        readable, _w, _x = select.select(fds, [], [], timeout)
+        if not readable:
+            return False
+        return self._consume()
@@ -0,0 +1,89 @@
+import time
+from django.conf import settings
+
+
+class LeaseLost(Exception):
+    """
+    The node lost the lease of the singleton phase it was running
+    """
+
+    pass
+
+
+class Phase:
+    """
+    A task of the job controller run.
+
+    Args:
+        name: name of the Job method that implements the phase.
+        interval: minimum number of seconds between two runs of the phase.
+            Zero means the phase runs every time the job controller runs.
+        budget: maximum number of seconds the phase may take in each run.
+            When the budget is exhausted the phase stops and continues in the
+            next job controller run. None means no limit.
+        enabled: the phase runs only if enabled.
+        background: run the phase in the background lane, after the
+            foreground phases have been started.
+        singleton: run the phase on only one node at a time, the one that
+            holds the lease of the phase.
+    """
+
+    def __init__(
+        self,
+        name,
+        interval=0,
+        budget=None,
+        enabled=True,
+        background=False,
+        singleton=False,
+    ):
+        self.name = name
+        self.interval = interval
+        self.budget = budget
+        self.enabled = enabled
+        self.background = background
+        self.singleton = singleton
+
+    def __repr__(self):
+        return f"Phase({self.name!r})"
+
+    def configure(self, **options):
+        """
+        Returns a copy of this phase with some options replaced.
+        """
+        values = {
+            "interval": self.interval,
+            "budget": self.budget,
+            "enabled": self.enabled,
+            "background": self.background,
+            "singleton": self.singleton,
+        }
+        values.update(options)
+        return Phase(self.name, **values)
+
+    def get_deadline(self):
+        if self.budget is None:
+            return None
+        return time.monotonic() + self.budget
+
+
+def get_leader_lease():
+    """
+    Seconds a node holds the lease of a singleton phase after acquiring it.
+    """
+    return getattr(settings, "JOB_CONTROLLER_LEADER_LEASE", 300)
+
+
+def time_is_up(deadline):
+    return deadline is not None and time.monotonic() > deadline
+
+
+def get_phases(phases):
+    """
+    Apply the options of the ``JOB_CONTROLLER_PHASES`` setting to `phases`.
+
+    The setting is a dict mapping phase names to dicts of Phase options, e.g.
+    ``{"remove_old_logs": {"interval": 86400}}``.
+    """
+    options = getattr(settings, "JOB_CONTROLLER_PHASES", {})
+    return [phase.configure(**options.get(phase.name, {})) for phase in phases]
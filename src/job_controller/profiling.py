@@ -0,0 +1,85 @@
+"""
+Profiling of job runs with cProfile.
+
+Profiles are stored as the zlib-compressed ``marshal`` dump of the profile
+statistics, the same format written by ``pstats.Stats.dump_stats`` once
+decompressed, so they can be opened by any tool that reads ``.prof`` files.
+"""
+
+import cProfile
+import io
+import marshal
+import pstats
+import sys
+import zlib
+
+# Since Python 3.12, cProfile is built on sys.monitoring, which sees the code
+# run by every thread of the process, not only the profiled one
+PROFILES_ALL_THREADS = sys.version_info >= (3, 12)
+
+
+class JobProfiler:
+    """
+    Context manager that profiles the code run by the current thread.
+
+    On Python 3.12 and later the profile also includes the code run by the
+    other threads meanwhile (other jobs, the job controller), since cProfile
+    cannot be limited to one thread there. Only one profiler may be active
+    at a time, so if another job is already being profiled the run is not
+    profiled and `error` tells why.
+    """
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.error = None
+
+    def __enter__(self):
+        try:
+            self.profile.enable()
+        except ValueError as e:
+            self.profile = None
+            self.error = str(e)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.profile is not None:
+            self.profile.disable()
+        return False
+
+    def dump(self):
+        """
+        Returns the compressed profile, or None if nothing was profiled.
+        """
+        if self.profile is None:
+            return None
+        self.profile.create_stats()
+        return zlib.compress(marshal.dumps(self.profile.stats))
+
+
+class _StoredProfile:
+    """
+    Profile loaded from its dump, as accepted by pstats.Stats
+    """
+
+    def __init__(self, data):
+        self.stats = marshal.loads(zlib.decompress(data))
+
+    def create_stats(self):
+        pass
+
+
+def decompress(data):
+    """
+    Returns the profile `data` in the ``.prof`` file format.
+    """
+    return zlib.decompress(data)
+
+
+def top_functions(data, limit=30, sort="cumulative"):
+    """
+    Returns the report of the `limit` top functions of the profile `data`.
+    """
+    output = io.StringIO()
+    stats = pstats.Stats(_StoredProfile(bytes(data)), stream=output)
+    stats.sort_stats(sort).print_stats(limit)
+    return output.getvalue()
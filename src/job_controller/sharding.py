@@ -0,0 +1,94 @@
+"""
+Sharded scheduling across several job controller nodes.
+
+When the ``JOB_CONTROLLER_SHARDING`` setting is True, each job controller
+node records a heartbeat in the ControllerNode table every time it runs. Nodes
+whose heartbeat is older than ``JOB_CONTROLLER_NODE_LEASE`` seconds are
+considered dead. The cron jobs are assigned to the live nodes by consistent
+hashing of ``app_name.job_name``, so when a node joins or dies only the jobs
+of that node move to other nodes.
+"""
+
+import bisect
+import hashlib
+import socket
+from django.conf import settings
+from django.utils import timezone
+from .models import ControllerNode, Cronjob
+
+# Points of each node in the hash ring. More points spread the jobs more
+# evenly between the nodes.
+REPLICAS = 160
+
+
+def is_enabled():
+    return getattr(settings, "JOB_CONTROLLER_SHARDING", False)
+
+
+def get_node_name():
+    name = getattr(settings, "JOB_CONTROLLER_NODE", None)
+    return name or socket.gethostname()
+
+
+def get_lease():
+    return getattr(settings, "JOB_CONTROLLER_NODE_LEASE", 180)
+
+
+def _hash(key):
+    return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+
+class HashRing:
+    def __init__(self, nodes, replicas=REPLICAS):
+        self.ring = sorted(
+            (_hash(f"{node}#{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self.keys = [key for key, _node in self.ring]
+
+    def get_node(self, key):
+        """
+        Returns the node that owns `key`, or None if there are no nodes.
+        """
+        if not self.ring:
+            return None
+        index = bisect.bisect(self.keys, _hash(key)) % len(self.ring)
+        return self.ring[index][1]
+
+
+def heartbeat(node_name=None):
+    """
+    Renew the lease of this node and forget the dead ones.
+
+    Returns:
+        The names of the live nodes.
+    """
+    if node_name is None:
+        node_name = get_node_name()
+    now = timezone.now()
+    if not ControllerNode.objects.filter(name=node_name).update(heartbeat=now):
+        ControllerNode.objects.get_or_create(
+            name=node_name, defaults={"heartbeat": now, "joined": now}
+        )
+    ControllerNode.objects.filter(
+        heartbeat__lt=now - timezone.timedelta(seconds=get_lease())
+    ).delete()
+    return list(ControllerNode.objects.values_list("name", flat=True))
+
+
+def get_shard(node_name=None):
+    """
+    Renew the lease of this node and returns the ids of the cron jobs it
+    owns.
+    """
+    if node_name is None:
+        node_name = get_node_name()
+    ring = HashRing(heartbeat(node_name))
+    return [
+        pk
+        for pk, app_name, job_name in Cronjob.objects.values_list(
+            "pk", "app_name", "job_name"
+        )
+        if ring.get_node(f"{app_name}.{job_name}") == node_name
+    ]
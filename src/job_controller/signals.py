@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from .models import Cronjob, JobSchedule
+from .notify import notify
+
+
+@receiver(post_save, sender=Cronjob)
+@receiver(post_save, sender=JobSchedule)
+def notify_changes(sender, **kwargs):
+    """
+    Wake up the job controller once the change is committed
+    """
+    transaction.on_commit(notify)
@@ -1,3 +1,926 @@
-from django.test import TestCase
+import io
+import marshal
+import os
+import socket
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from itertools import islice
+from unittest import mock
+from cron_converter import Cron
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase, override_settings
+from django.urls import path, reverse
+from django.utils import timezone
+from django_extensions.management.jobs import BaseJob, HourlyJob
+from .capture import capture_output
+from .cron import compile_cron, next_fire_times
+from .jobs.job_controller import MIN_SLEEP_TIME, Job
+from .management.commands.runjobcontroller import ERROR_SLEEP_TIME
+from .models import (
+    ControllerNode,
+    ControllerPhase,
+    Cronjob,
+    JobProfile,
+    JobSchedule,
+)
+from .notify import Listener, notify
+from .phases import Phase
+from .profiling import decompress, top_functions
+from .sharding import HashRing, get_shard, heartbeat
 
-# Create your tests here.
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    # Python 3.8, installed with Django
+    from backports.zoneinfo import ZoneInfo
+
+UTC = ZoneInfo("UTC")
+
+# The admin views are tested with this module as ROOT_URLCONF
+urlpatterns = [path("admin/", admin.site.urls)]
+
+
+class ProfiledJob(BaseJob):
+    help = "Job run by the tests"
+
+    def execute(self):
+        print(sum(i * i for i in range(1000)))
+
+
+class AccountedJob(BaseJob):
+    help = "Job whose resource usage is measured by the tests"
+
+    def execute(self):
+        for _ in range(3):
+            Cronjob.objects.count()
+        # Use some CPU time
+        started = time.thread_time()
+        while time.thread_time() - started < 0.05:
+            pass
+        # 7 bytes in UTF-8, with the new line
+        print("ação")
+
+
+class SpreadTests(TestCase):
+    def setUp(self):
+        self.start = datetime(
+            2025, 3, 1, tzinfo=timezone.get_current_timezone()
+        )
+
+    def create(self, job_name, cron_expression="0 * * * *", **kwargs):
+        return Cronjob.objects.create(
+            app_name="app",
+            job_name=job_name,
+            cron_expression=cron_expression,
+            **kwargs,
+        )
+
+    def test_no_spreading(self):
+        job = self.create("job")
+        self.assertEqual(job.get_start_offset(self.start), timedelta(0))
+
+    def test_jitter(self):
+        job = self.create("job", spread_mode=Cronjob.SPREAD_JITTER)
+        offset = job.get_start_offset(self.start)
+        self.assertEqual(
+            offset, timedelta(seconds=zlib.crc32(b"app.job") % 300)
+        )
+        # The same delay at every instant
+        self.assertEqual(
+            job.get_start_offset(self.start + timedelta(hours=5)), offset
+        )
+
+    def test_window_cap(self):
+        # The delay never reaches the following CRON instant, two minutes
+        # later
+        for mode in (Cronjob.SPREAD_JITTER, Cronjob.SPREAD_PLANNED):
+            for i in range(10):
+                job = self.create(
+                    f"{mode}{i}", "*/2 * * * *", spread_mode=mode
+                )
+                with self.subTest(job=job):
+                    self.assertLess(
+                        job.get_start_offset(self.start),
+                        timedelta(minutes=2),
+                    )
+
+    def test_slots(self):
+        jobs = [
+            self.create(name, spread_mode=Cronjob.SPREAD_PLANNED)
+            for name in ("c", "a", "b")
+        ]
+        self.assertEqual(
+            [job.get_start_offset(self.start).total_seconds() for job in jobs],
+            [200, 0, 100],
+        )
+
+    def test_slots_of_different_expressions(self):
+        hourly = self.create("a_hourly", spread_mode=Cronjob.SPREAD_PLANNED)
+        daily = self.create(
+            "b_daily", "0 0 * * *", spread_mode=Cronjob.SPREAD_PLANNED
+        )
+        # Both fire at midnight
+        self.assertEqual(hourly.get_start_offset(self.start), timedelta(0))
+        self.assertEqual(
+            daily.get_start_offset(self.start), timedelta(seconds=150)
+        )
+        # Only the hourly job fires at one o'clock
+        self.assertEqual(
+            hourly.get_start_offset(self.start + timedelta(hours=1)),
+            timedelta(0),
+        )
+
+
+class RetryTests(TestCase):
+    def setUp(self):
+        self.job = Cronjob.objects.create(
+            app_name="missing",
+            job_name="missing",
+            retry_attempts=3,
+            retry_delay=60,
+            retry_backoff=2.0,
+        )
+
+    def failed_run(self, attempt=1):
+        return JobSchedule.objects.create(
+            job=self.job,
+            start=timezone.now(),
+            started=timezone.now(),
+            status=JobSchedule.STATUS_FINISHED,
+            has_errors=True,
+            attempt=attempt,
+        )
+
+    def test_backoff(self):
+        delays = [self.job.get_retry_delay(retry) for retry in (1, 2, 3)]
+        self.assertEqual(
+            delays,
+            [
+                timedelta(seconds=60),
+                timedelta(seconds=120),
+                timedelta(seconds=240),
+            ],
+        )
+
+    def test_max_delay(self):
+        self.assertEqual(self.job.get_retry_delay(40), timedelta(hours=1))
+        # The power itself overflows
+        self.assertEqual(self.job.get_retry_delay(5000), timedelta(hours=1))
+
+    def test_jitter(self):
+        self.job.retry_jitter = 10
+        for _ in range(20):
+            delay = self.job.get_retry_delay(1).total_seconds()
+            self.assertTrue(60 <= delay <= 70)
+
+    def test_schedule_retry(self):
+        run = self.failed_run()
+        retry = run.schedule_retry()
+        self.assertEqual(retry.attempt, 2)
+        self.assertEqual(retry.retry_of, run)
+        self.assertEqual(retry.status, JobSchedule.STATUS_SCHEDULED)
+        # Retries of retries point to the original run
+        self.assertEqual(retry.schedule_retry().retry_of, run)
+
+    def test_no_more_retries(self):
+        self.assertIsNone(self.failed_run(attempt=4).schedule_retry())
+
+    def test_failed_retry_keeps_run_finished(self):
+        schedule = JobSchedule.objects.create(
+            job=self.job, start=timezone.now()
+        )
+        with mock.patch.object(
+            Cronjob, "get_retry_delay", side_effect=OverflowError("too late")
+        ):
+            schedule.run_job()
+        schedule.refresh_from_db()
+        self.assertEqual(schedule.status, JobSchedule.STATUS_FINISHED)
+        self.assertTrue(schedule.has_errors)
+        self.assertIn("too late", schedule.result)
+        self.assertFalse(self.job.jobschedule_set.filter(attempt=2).exists())
+
+
+class RescheduleTests(TestCase):
+    def test_reschedule(self):
+        job = Cronjob.objects.create(
+            app_name="missing", job_name="missing", cron_expression="0 3 * * *"
+        )
+        old = job.next_schedule()
+        job.cron_expression = "*/5 * * * *"
+        job.save()
+        new = job.reschedule()
+        self.assertNotEqual(new.pk, old.pk)
+        self.assertFalse(JobSchedule.objects.filter(pk=old.pk).exists())
+        self.assertLessEqual(new.start, timezone.now() + timedelta(minutes=5))
+
+    def test_keep_retries(self):
+        job = Cronjob.objects.create(app_name="missing", job_name="missing")
+        retry = JobSchedule.objects.create(
+            job=job,
+            start=timezone.now() + timedelta(minutes=10),
+            retry_of=JobSchedule.objects.create(
+                job=job,
+                start=timezone.now(),
+                status=JobSchedule.STATUS_FINISHED,
+            ),
+            attempt=2,
+        )
+        self.assertEqual(job.reschedule(), retry)
+
+
+class SleepTimeTests(TestCase):
+    def setUp(self):
+        self.job = Cronjob.objects.create(app_name="app", job_name="job")
+
+    def test_nothing_due(self):
+        self.assertIsNone(Job().get_sleep_time())
+
+    def test_next_start(self):
+        JobSchedule.objects.create(
+            job=self.job, start=timezone.now() + timedelta(minutes=10)
+        )
+        self.assertAlmostEqual(Job().get_sleep_time(), 600, delta=5)
+
+    def test_already_due(self):
+        # The schedule fell due after run_scheduled, while the controller was
+        # running the other phases
+        JobSchedule.objects.create(
+            job=self.job, start=timezone.now() - timedelta(milliseconds=200)
+        )
+        self.assertEqual(Job().get_sleep_time(), MIN_SLEEP_TIME)
+
+
+@override_settings(JOB_CONTROLLER_SOCKET=None)
+class NotifyTests(TestCase):
+    def setUp(self):
+        self.listener = Listener().__enter__()
+        self.addCleanup(self.listener.__exit__, None, None, None)
+        # Forget the notifications of the previous tests
+        self.listener.wait(0)
+
+    def test_timeout(self):
+        self.assertFalse(self.listener.wait(0))
+
+    def test_notify(self):
+        notify()
+        notify()
+        self.assertTrue(self.listener.wait(0))
+        self.assertFalse(self.listener.wait(0))
+
+    def test_wake_up(self):
+        threading.Timer(0.1, notify).start()
+        started = time.monotonic()
+        self.assertTrue(self.listener.wait(10))
+        self.assertLess(time.monotonic() - started, 5)
+
+    def test_signals(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            job = Cronjob.objects.create(app_name="app", job_name="job")
+        # Nothing is sent before the commit
+        self.assertFalse(self.listener.wait(0))
+        for callback in callbacks:
+            callback()
+        self.assertTrue(self.listener.wait(0))
+        with self.captureOnCommitCallbacks(execute=True):
+            JobSchedule.objects.create(job=job, start=timezone.now())
+        self.assertTrue(self.listener.wait(0))
+
+    def test_socket(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "job_controller.sock")
+            with override_settings(JOB_CONTROLLER_SOCKET=path):
+                with Listener() as listener:
+                    self.assertFalse(listener.wait(0))
+                    # Sent by another process
+                    with socket.socket(
+                        socket.AF_UNIX, socket.SOCK_DGRAM
+                    ) as sock:
+                        sock.sendto(b"1", path)
+                    self.assertTrue(listener.wait(0))
+                self.assertFalse(os.path.exists(path))
+
+
+@override_settings(JOB_CONTROLLER_SOCKET=None)
+class ResidentTests(TestCase):
+    def test_errors(self):
+        stderr = io.StringIO()
+        with mock.patch.object(
+            Job,
+            "execute",
+            side_effect=[OperationalError("database is locked"), None],
+        ) as execute, mock.patch.object(
+            Job, "get_sleep_time", return_value=None
+        ), mock.patch.object(
+            Listener, "wait", side_effect=KeyboardInterrupt
+        ) as wait, mock.patch(
+            "job_controller.management.commands.runjobcontroller.time.sleep"
+        ) as sleep:
+            with self.assertRaises(KeyboardInterrupt):
+                call_command("runjobcontroller", max_sleep=30, stderr=stderr)
+        # The error did not stop the job controller
+        self.assertEqual(execute.call_count, 2)
+        self.assertIn("database is locked", stderr.getvalue())
+        sleep.assert_called_once_with(ERROR_SLEEP_TIME)
+        wait.assert_called_once_with(30)
+
+
+class PhaseTests(TestCase):
+    def setUp(self):
+        # Hide the progress of the job controller
+        patcher = mock.patch("sys.stdout", new_callable=io.StringIO)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_resume(self):
+        jobs = [
+            Cronjob.objects.create(app_name="app", job_name=f"job{i}")
+            for i in range(3)
+        ]
+        for job in jobs:
+            JobSchedule.objects.create(
+                job=job,
+                start=timezone.now() - timedelta(days=60),
+                started=timezone.now() - timedelta(days=60),
+                status=JobSchedule.STATUS_FINISHED,
+                reported=True,
+            )
+        phase = Phase("remove_old_logs", interval=3600)
+        with mock.patch(
+            "job_controller.jobs.job_controller.time_is_up",
+            side_effect=[False, True],
+        ):
+            Job().run_phase(phase)
+        state = ControllerPhase.objects.get(name="remove_old_logs")
+        self.assertEqual(state.cursor, str(jobs[1].pk))
+        self.assertIsNone(state.last_run)
+        self.assertEqual(JobSchedule.objects.count(), 2)
+        with mock.patch(
+            "job_controller.jobs.job_controller.time_is_up",
+            return_value=False,
+        ) as time_is_up:
+            Job().run_phase(phase)
+        # The first job is not visited again
+        self.assertEqual(time_is_up.call_count, 2)
+        state.refresh_from_db()
+        self.assertEqual(state.cursor, "")
+        self.assertIsNotNone(state.last_run)
+        self.assertFalse(JobSchedule.objects.exists())
+
+    def test_schedule_new_jobs(self):
+        class NewJob(HourlyJob):
+            pass
+
+        with mock.patch(
+            "job_controller.jobs.job_controller.get_jobs",
+            return_value={("app", "new"): NewJob},
+        ):
+            Job().sync_new_jobs()
+        job = Cronjob.objects.get(app_name="app", job_name="new")
+        self.assertEqual(job.cron_expression, "0 * * * *")
+        self.assertEqual(
+            job.jobschedule_set.get().status, JobSchedule.STATUS_SCHEDULED
+        )
+
+
+class CaptureTests(TestCase):
+    def test_threads(self):
+        outputs = {}
+        barrier = threading.Barrier(2)
+
+        def run(name):
+            with capture_output() as (stdout, stderr):
+                barrier.wait()
+                print(name)
+                barrier.wait()
+            outputs[name] = stdout.getvalue()
+
+        threads = [
+            threading.Thread(target=run, args=[name]) for name in ("a", "b")
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(outputs, {"a": "a\n", "b": "b\n"})
+
+    def test_job_not_found(self):
+        job = Cronjob.objects.create(app_name="missing", job_name="missing")
+        schedule = JobSchedule.objects.create(job=job, start=timezone.now())
+        schedule.run_job()
+        schedule.refresh_from_db()
+        self.assertIsNone(schedule.queries)
+        self.assertIsNone(schedule.output_bytes)
+
+
+@override_settings(ROOT_URLCONF="job_controller.tests")
+class ProfilingTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch(
+            "job_controller.models.get_job", return_value=ProfiledJob
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.job = Cronjob.objects.create(
+            app_name="app", job_name="profiled", profile_next_run=True
+        )
+
+    def run_schedule(self):
+        schedule = JobSchedule.objects.create(
+            job=self.job, start=timezone.now()
+        )
+        schedule.run_job()
+        schedule.refresh_from_db()
+        return schedule
+
+    def test_profile_next_run(self):
+        schedule = self.run_schedule()
+        self.job.refresh_from_db()
+        self.assertFalse(self.job.profile_next_run)
+        self.assertFalse(schedule.has_errors)
+        data = JobProfile.objects.get(schedule=schedule).data
+        # The .prof file holds the statistics of the functions run by the job
+        functions = {
+            function for _file, _line, function in marshal.loads(
+                decompress(data)
+            )
+        }
+        self.assertIn("execute", functions)
+        self.assertIn("execute", top_functions(data, limit=100))
+        # Only the next run is profiled
+        self.assertFalse(hasattr(self.run_schedule(), "profile"))
+
+    def test_not_profiled(self):
+        with mock.patch(
+            "job_controller.profiling.cProfile.Profile"
+        ) as Profile:
+            Profile.return_value.enable.side_effect = ValueError(
+                "Another profiling tool is already active"
+            )
+            schedule = self.run_schedule()
+        self.assertEqual(schedule.status, JobSchedule.STATUS_FINISHED)
+        self.assertIn(
+            "could not be profiled: Another profiling tool is already active",
+            schedule.result,
+        )
+        self.assertFalse(JobProfile.objects.exists())
+
+    def test_admin_views(self):
+        self.client.force_login(
+            User.objects.create_superuser("admin", "admin@example.com", "pw")
+        )
+        profiled = self.run_schedule()
+        not_profiled = self.run_schedule()
+        response = self.client.get(
+            reverse(
+                "admin:job_controller_jobschedule_profile", args=[profiled.pk]
+            )
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.content, decompress(profiled.profile.data)
+        )
+        for sort in ("cumulative", "tottime", "bogus"):
+            response = self.client.get(
+                reverse(
+                    "admin:job_controller_jobschedule_profile_top",
+                    args=[profiled.pk],
+                ),
+                {"sort": sort},
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, "execute")
+        for name in ("profile", "profile_top"):
+            for pk in (not_profiled.pk, 0):
+                response = self.client.get(
+                    reverse(
+                        f"admin:job_controller_jobschedule_{name}", args=[pk]
+                    )
+                )
+                self.assertEqual(response.status_code, 404)
+
+
+@override_settings(ROOT_URLCONF="job_controller.tests")
+class AccountingTests(TestCase):
+    def test_run(self):
+        job = Cronjob.objects.create(app_name="app", job_name="accounted")
+        schedule = JobSchedule.objects.create(job=job, start=timezone.now())
+        with mock.patch(
+            "job_controller.models.get_job", return_value=AccountedJob
+        ):
+            schedule.run_job()
+        schedule.refresh_from_db()
+        self.assertFalse(schedule.has_errors, schedule.result)
+        # The queries of the job controller itself are not counted
+        self.assertEqual(schedule.queries, 3)
+        self.assertGreater(schedule.query_time, timedelta(0))
+        self.assertGreaterEqual(
+            schedule.cpu_user + schedule.cpu_system, timedelta(seconds=0.04)
+        )
+        self.assertEqual(schedule.output_bytes, 7)
+        self.assertIsNotNone(schedule.peak_memory)
+
+    def test_usage_view(self):
+        def run(job, days_ago=0, **usage):
+            JobSchedule.objects.create(
+                job=job,
+                start=timezone.now() - timedelta(days=days_ago),
+                started=timezone.now() - timedelta(days=days_ago),
+                status=JobSchedule.STATUS_FINISHED,
+                time_spent=timedelta(seconds=1),
+                **usage,
+            )
+
+        chatty = Cronjob.objects.create(app_name="app", job_name="chatty")
+        busy = Cronjob.objects.create(app_name="app", job_name="busy")
+        idle = Cronjob.objects.create(app_name="app", job_name="idle")
+        run(chatty, queries=5, output_bytes=1000, peak_memory=10)
+        run(chatty, queries=7, output_bytes=2000, peak_memory=30)
+        run(busy, queries=20, output_bytes=10, peak_memory=20)
+        # Older than the period
+        run(busy, days_ago=10, queries=100, output_bytes=100000)
+        # Runs not measured are left out
+        run(idle)
+        self.client.force_login(
+            User.objects.create_superuser("admin", "admin@example.com", "pw")
+        )
+        url = reverse("admin:job_controller_cronjob_usage")
+
+        def rows(**params):
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            return [
+                (row["job__job_name"], row[params["order"]])
+                for row in response.context["rows"]
+            ]
+
+        self.assertEqual(
+            rows(order="queries"), [("busy", 20), ("chatty", 12)]
+        )
+        self.assertEqual(
+            rows(order="output_bytes"), [("chatty", 3000), ("busy", 10)]
+        )
+        self.assertEqual(
+            rows(order="peak_memory"), [("chatty", 30), ("busy", 20)]
+        )
+        self.assertEqual(
+            rows(order="queries", days=30), [("busy", 120), ("chatty", 12)]
+        )
+        self.assertEqual(rows(order="queries", top=1), [("busy", 20)])
+
+
+class CronTests(TestCase):
+    """
+    The compiled CRON expressions must give the same fire times as
+    cron-converter, which they replace, except on DST changes where
+    cron-converter may give the same instant twice or go back in time.
+    """
+
+    expressions = [
+        "* * * * *",
+        "*/7 * * * *",
+        "0 * * * *",
+        "30 2 * * *",
+        "*/20 1-3 * * *",
+        "0 0 * * *",
+        "15 10 * * 1-5",
+        "0 0 1 * *",
+        "0 12 13 * 5",
+        "0 0 31 * *",
+        "0 0 29 2 *",
+        "0 0 1 1 *",
+        "5 4 * 6-8 0",
+    ]
+
+    def assertSameFireTimes(self, expression, start, tz, count=30):
+        schedule = Cron(expression).schedule(start)
+        fire_time = start
+        for _ in range(count):
+            expected = schedule.next()
+            fire_time = compile_cron(expression).next(fire_time, tz)
+            # isoformat() also compares the UTC offsets
+            self.assertEqual(
+                fire_time.isoformat(), expected.isoformat(), expression
+            )
+
+    def test_same_as_cron_converter(self):
+        for tz_name in ("UTC", "America/Sao_Paulo", "Asia/Kolkata"):
+            tz = ZoneInfo(tz_name)
+            start = datetime(2025, 2, 27, 22, 51, 13, tzinfo=tz)
+            for expression in self.expressions:
+                with self.subTest(expression=expression, tz=tz_name):
+                    self.assertSameFireTimes(expression, start, tz)
+
+    def assertIncreasing(self, expression, start, tz, count=30):
+        """
+        Returns the UTC instants of the first `count` fire times of
+        `expression`, checking that they strictly increase.
+        """
+        instants = [
+            fire_time.astimezone(UTC)
+            for fire_time in islice(
+                compile_cron(expression).iter(start, tz=tz), count
+            )
+        ]
+        self.assertGreater(instants[0], start)
+        for previous, instant in zip(instants, instants[1:]):
+            self.assertGreater(instant, previous, expression)
+        return instants
+
+    def test_dst_gap(self):
+        # 2024-03-31 02:00 CET (01:00 UTC) jumps to 03:00 CEST
+        tz = ZoneInfo("Europe/Berlin")
+        start = datetime(2024, 3, 31, 1, 30, tzinfo=tz)
+        # The skipped 02:00 happens at 03:00 CEST, then 03:15 CEST follows:
+        # the skipped hour is not run again
+        self.assertEqual(
+            self.assertIncreasing("*/15 * * * *", start, tz, count=8),
+            [
+                datetime(2024, 3, 31, 0, 45, tzinfo=UTC)
+                + timedelta(minutes=15 * i)
+                for i in range(8)
+            ],
+        )
+        self.assertEqual(
+            self.assertIncreasing("30 2 * * *", start, tz, count=2),
+            [
+                datetime(2024, 3, 31, 1, 30, tzinfo=UTC),
+                datetime(2024, 4, 1, 0, 30, tzinfo=UTC),
+            ],
+        )
+        self.assertIncreasing("0 3 * * *", start, tz)
+        # A time skipped by the change is the same instant one hour later
+        self.assertEqual(
+            compile_cron("*/15 * * * *").next(
+                datetime(2024, 3, 31, 2, 15, tzinfo=tz), tz
+            ),
+            datetime(2024, 3, 31, 1, 30, tzinfo=UTC),
+        )
+
+    def test_dst_overlap(self):
+        # 2024-10-27 03:00 CEST (01:00 UTC) goes back to 02:00 CET
+        tz = ZoneInfo("Europe/Berlin")
+        start = datetime(2024, 10, 27, 1, 30, tzinfo=tz)
+        # The repeated times happen only once, at their first occurrence
+        self.assertEqual(
+            self.assertIncreasing("*/20 * * * *", start, tz, count=5),
+            [
+                datetime(2024, 10, 26, 23, 40, tzinfo=UTC),
+                datetime(2024, 10, 27, 0, 0, tzinfo=UTC),
+                datetime(2024, 10, 27, 0, 20, tzinfo=UTC),
+                datetime(2024, 10, 27, 0, 40, tzinfo=UTC),
+                datetime(2024, 10, 27, 2, 0, tzinfo=UTC),
+            ],
+        )
+        fire_times = list(
+            compile_cron("30 2 * * *").iter(
+                start, start + timedelta(hours=5), tz
+            )
+        )
+        self.assertEqual(len(fire_times), 1)
+        self.assertIncreasing("* * * * *", start, tz, count=200)
+        # During the second occurrence of the repeated hour, the next fire
+        # time is never in the past
+        for minute in range(60):
+            after = datetime(2024, 10, 27, 2, minute, fold=1, tzinfo=tz)
+            with self.subTest(after=after):
+                self.assertEqual(
+                    compile_cron("* * * * *").next(after, tz),
+                    datetime(2024, 10, 27, 2, 0, tzinfo=UTC),
+                )
+
+    def test_southern_dst(self):
+        # Sao Paulo had DST until 2019, starting and ending at midnight
+        tz = ZoneInfo("America/Sao_Paulo")
+        for start in (
+            datetime(2018, 11, 3, 22, 0, tzinfo=tz),
+            datetime(2019, 2, 16, 22, 0, tzinfo=tz),
+        ):
+            for expression in ("*/15 * * * *", "0 0 * * *", "30 23 * * *"):
+                with self.subTest(expression=expression, start=start):
+                    self.assertIncreasing(expression, start, tz, count=10)
+        # The skipped midnight happens at 01:00 -02:00
+        self.assertEqual(
+            compile_cron("0 0 * * *").next(
+                datetime(2018, 11, 3, 22, 0, tzinfo=tz), tz
+            ),
+            datetime(2018, 11, 4, 3, 0, tzinfo=UTC),
+        )
+        # The repeated 23:30 happens once
+        self.assertEqual(
+            len(
+                list(
+                    compile_cron("30 23 * * *").iter(
+                        datetime(2019, 2, 16, 22, 0, tzinfo=tz),
+                        datetime(2019, 2, 17, 12, 0, tzinfo=tz),
+                        tz,
+                    )
+                )
+            ),
+            1,
+        )
+
+    def test_leap_day(self):
+        tz = ZoneInfo("UTC")
+        start = datetime(2025, 1, 1, tzinfo=tz)
+        self.assertEqual(
+            compile_cron("0 0 29 2 *").next(start, tz),
+            datetime(2028, 2, 29, tzinfo=tz),
+        )
+
+    def test_impossible_dates(self):
+        tz = ZoneInfo("UTC")
+        start = datetime(2025, 1, 1, tzinfo=tz)
+        for expression in ("0 0 30 2 *", "0 0 31 4 *", "0 0 31 6,9,11 *"):
+            with self.subTest(expression=expression):
+                with self.assertRaises(ValueError):
+                    compile_cron(expression).next(start, tz)
+                # cron-converter fails too
+                with self.assertRaises(Exception):
+                    Cron(expression).schedule(start).next()
+        self.assertEqual(
+            next_fire_times(["0 0 30 2 *"], start, start + timedelta(days=1)),
+            {"0 0 30 2 *": []},
+        )
+
+    def test_invalid_expression(self):
+        with self.assertRaises(ValueError):
+            compile_cron("61 * * * *")
+
+    def test_next_fire_times(self):
+        tz = ZoneInfo("UTC")
+        start = datetime(2025, 1, 1, tzinfo=tz)
+        result = next_fire_times(
+            ["0 * * * *", "0 * * * *", "bogus"],
+            start,
+            start + timedelta(hours=3),
+            tz=tz,
+        )
+        self.assertEqual(
+            result["0 * * * *"],
+            [start + timedelta(hours=hour) for hour in (1, 2, 3)],
+        )
+        self.assertEqual(result["bogus"], [])
+        self.assertEqual(
+            len(
+                next_fire_times(
+                    ["* * * * *"], start, start + timedelta(days=1), limit=5
+                )["* * * * *"]
+            ),
+            5,
+        )
+
+
+class HashRingTests(TestCase):
+    keys = [f"app.job{i}" for i in range(1000)]
+
+    def test_empty(self):
+        self.assertIsNone(HashRing([]).get_node("app.job"))
+
+    def test_balance(self):
+        ring = HashRing(["a", "b", "c"])
+        owners = [ring.get_node(key) for key in self.keys]
+        for node in ("a", "b", "c"):
+            self.assertTrue(200 < owners.count(node) < 470, node)
+
+    def test_node_joins(self):
+        before = HashRing(["a", "b", "c"])
+        after = HashRing(["a", "b", "c", "d"])
+        for key in self.keys:
+            if after.get_node(key) != before.get_node(key):
+                # Only the keys taken by the new node move
+                self.assertEqual(after.get_node(key), "d")
+
+    def test_node_dies(self):
+        before = HashRing(["a", "b", "c"])
+        after = HashRing(["a", "c"])
+        for key in self.keys:
+            if before.get_node(key) != "b":
+                self.assertEqual(after.get_node(key), before.get_node(key))
+
+
+class ShardingTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch("sys.stdout", new_callable=io.StringIO)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_shards(self):
+        jobs = {
+            Cronjob.objects.create(app_name="app", job_name=f"job{i}").pk
+            for i in range(50)
+        }
+        heartbeat("node-a")
+        heartbeat("node-b")
+        shard_a = get_shard("node-a")
+        shard_b = get_shard("node-b")
+        self.assertTrue(shard_a and shard_b)
+        self.assertFalse(set(shard_a) & set(shard_b))
+        self.assertEqual(set(shard_a) | set(shard_b), jobs)
+
+    def test_dead_nodes(self):
+        ControllerNode.objects.create(
+            name="dead",
+            joined=timezone.now() - timedelta(days=1),
+            heartbeat=timezone.now() - timedelta(hours=1),
+        )
+        self.assertEqual(heartbeat("node-a"), ["node-a"])
+
+    def test_sharded_phase_runs_on_each_node(self):
+        phase = Phase("remove_old_logs", interval=3600)
+
+        def due_phases(node):
+            with override_settings(
+                JOB_CONTROLLER_SHARDING=True, JOB_CONTROLLER_NODE=node
+            ):
+                controller = Job()
+                controller.shard = get_shard()
+                controller.phases = [phase]
+                due = controller.get_due_phases()
+                for due_phase in due:
+                    controller.run_phase(due_phase)
+                return due
+
+        self.assertEqual(len(due_phases("node-a")), 1)
+        # The last run of node-a does not hold node-b back
+        self.assertEqual(len(due_phases("node-b")), 1)
+        self.assertEqual(due_phases("node-a"), [])
+        self.assertEqual(
+            set(
+                ControllerPhase.objects.exclude(last_run=None).values_list(
+                    "node", flat=True
+                )
+            ),
+            {"node-a", "node-b"},
+        )
+
+
+class LeaseTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch("sys.stdout", new_callable=io.StringIO)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def acquire(self, node, phase):
+        with override_settings(JOB_CONTROLLER_NODE=node):
+            return Job().acquire_lease(phase)
+
+    def expire(self, phase):
+        ControllerPhase.objects.filter(name=phase.name).update(
+            lease_expires=timezone.now() - timedelta(seconds=1)
+        )
+
+    def test_acquire(self):
+        phase = Phase("digest_emails", singleton=True)
+        self.assertEqual(self.acquire("node-a", phase), 1)
+        self.assertIsNone(self.acquire("node-b", phase))
+        # The leader renews its lease
+        self.assertEqual(self.acquire("node-a", phase), 2)
+        self.expire(phase)
+        self.assertEqual(self.acquire("node-b", phase), 3)
+        self.assertEqual(
+            ControllerPhase.objects.get(name=phase.name).leader, "node-b"
+        )
+
+    def test_not_due(self):
+        phase = Phase("remove_old_logs", interval=3600, singleton=True)
+        ControllerPhase.objects.create(
+            name=phase.name, last_run=timezone.now() - timedelta(minutes=5)
+        )
+        # The lease is free, but the phase has just run
+        self.assertIsNone(self.acquire("node-a", phase))
+        ControllerPhase.objects.filter(name=phase.name).update(
+            last_run=timezone.now() - timedelta(hours=2)
+        )
+        self.assertEqual(self.acquire("node-a", phase), 1)
+
+    def test_fencing(self):
+        phase = Phase("remove_old_logs", interval=3600, singleton=True)
+        job = Cronjob.objects.create(app_name="app", job_name="job")
+        JobSchedule.objects.create(
+            job=job,
+            start=timezone.now() - timedelta(days=60),
+            started=timezone.now() - timedelta(days=60),
+            status=JobSchedule.STATUS_FINISHED,
+            reported=True,
+        )
+
+        def take_over(*args, **kwargs):
+            # Another node takes the lease over while node-a runs the phase
+            self.expire(phase)
+            self.acquire("node-b", phase)
+            return False
+
+        with override_settings(JOB_CONTROLLER_NODE="node-a"), mock.patch(
+            "job_controller.jobs.job_controller.time_is_up",
+            side_effect=take_over,
+        ):
+            Job().run_phase(phase)
+        # Nothing was deleted nor recorded by node-a
+        self.assertEqual(JobSchedule.objects.count(), 1)
+        self.assertIsNone(ControllerPhase.objects.get(name=phase.name).last_run)